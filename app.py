@@ -19,6 +19,7 @@ from pytube import YouTube
 # Backend API config
 BACKEND_URL = "http://localhost:8000/api"
 WS_URL = "ws://localhost:8000/ws"
+CHANGES_POLL_TIMEOUT = 3  # seconds; the poll blocks the script, so a click waits no longer than the old fixed sleep
 
 # Page config
 st.set_page_config(
@@ -680,7 +681,7 @@ def render_chat_section():
     chat_container = st.container()
     with chat_container:
         for idx, msg in enumerate(st.session_state.chat_messages[-20:]):
-            timestamp = datetime.fromisoformat(msg['timestamp']).strftime("%H:%M")
+            timestamp = datetime.fromtimestamp(msg['timestamp'] / 1000).strftime("%H:%M")
             avatar_html = f'<img src="{st.session_state.avatar_url}" style="width:32px;height:32px;border-radius:50%;vertical-align:middle;margin-right:8px;">' if st.session_state.avatar_url else ''
             
             # Sanitize content before rendering
@@ -1123,20 +1124,20 @@ def update_room_state():
 
     try:
         # --- Fast Polling: Chat Messages (every ~3 seconds) ---
-        last_timestamp = "1970-01-01T00:00:00.000000"
-        if st.session_state.chat_messages:
-            last_timestamp = st.session_state.chat_messages[-1]['timestamp']
-        
-        # For this to be efficient, the backend API must support the `since` parameter
-        # to return only new messages. Otherwise, it will re-send the full history.
-        new_messages = api_get(f"/chat/{st.session_state.room_code}/messages?since={last_timestamp}")
+        # Only messages after the last one polled come back; our own posts were added when sent
+        last_id = st.session_state.get('chat_last_id')
+        query = f"after_id={last_id}" if last_id else "limit=50"
+        new_messages = api_get(f"/chat/{st.session_state.room_code}/messages?{query}")
         
         if new_messages:
+            st.session_state.chat_last_id = new_messages[-1]['id']
+            known_ids = {msg.get('id') for msg in st.session_state.chat_messages}
+            new_messages = [msg for msg in new_messages if msg['id'] not in known_ids]
             st.session_state.chat_messages.extend(new_messages)
             st.session_state.unread_count += len(new_messages)
 
-        # --- Slow Polling: General Room Info (every 4th poll, i.e., ~12 seconds) ---
-        if st.session_state.poll_counter % 4 == 0:
+        # --- General Room Info: when the change feed reported more than chat, and every 4th poll regardless ---
+        if st.session_state.pop('room_changed', False) or st.session_state.poll_counter % 4 == 0:
             room_info = api_get(f"/rooms/{st.session_state.room_code}")
             if room_info:
                 # Check for host promotion
@@ -1156,6 +1157,31 @@ def update_room_state():
         # Could log this for debugging, but don't show UI error on a poll
         pass
 
+def wait_for_room_changes():
+    """
+    Waits for something to happen in the room, using the backend's long-poll change feed.
+    Returns as soon as the room changes, and otherwise after CHANGES_POLL_TIMEOUT seconds,
+    so input made during the wait reruns no later than it did with the fixed 3-second sleep.
+    """
+    params = {'timeout': CHANGES_POLL_TIMEOUT}
+    # Cursors count one room's events, so one kept from another room is not reused
+    if st.session_state.get('changes_room') == st.session_state.room_code:
+        params['cursor'] = st.session_state.changes_cursor
+    try:
+        r = requests.get(f"{BACKEND_URL}/rooms/{st.session_state.room_code}/changes",
+                         params=params, timeout=CHANGES_POLL_TIMEOUT + 5)
+        r.raise_for_status()
+        batch = r.json()
+    except (requests.RequestException, ValueError):
+        # Backend unreachable: fall back to the fixed polling interval
+        time.sleep(3)
+        return
+    
+    st.session_state.changes_room = st.session_state.room_code
+    st.session_state.changes_cursor = batch['cursor']
+    if batch['reset'] or any(event.get('type') != 'chat_message' for event in batch['events']):
+        st.session_state.room_changed = True
+
 def main():
     theme_toggle()
     st.markdown('<h1 class="main-header">🎬 PartyWatch</h1>', unsafe_allow_html=True)
@@ -1199,6 +1225,7 @@ def main():
                     st.session_state.current_spotify_id = None
                     st.session_state.playback_state = {'playing': False, 'current_time': 0}
                     st.session_state.chat_messages = []
+                    st.session_state.chat_last_id = None
                     st.rerun()
         else:
             if st.session_state.room_type == "YouTube":
@@ -1327,10 +1354,10 @@ def main():
             render_user_presence()
             render_chat_section()
         
-        # This polling loop is a simple way to keep the app updated
-        # with new messages and user statuses from the backend.
+        # Keep the app updated with new messages and user statuses from the backend,
+        # rerunning as soon as the room changes instead of on a fixed interval.
         update_room_state()
-        time.sleep(3)
+        wait_for_room_changes()
         st.rerun()
     else:
         st.markdown("""
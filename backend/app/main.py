@@ -1,12 +1,30 @@
-from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi import FastAPI, Header, WebSocket, WebSocketDisconnect, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Dict, List, Optional
-import json
-import uuid
-from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import secrets
 
-app = FastAPI(title="PartyWatch Backend")
+from backend.app.services.chat_log import ChatLog
+from backend.app.services.connection_manager import manager
+from records import ChatMessage as ChatRecord, RoomInfo, epoch_ms, new_id
+from backend.app.services.change_feed import ChangeFeed
+from backend.app.services.retention import RetentionIndex, Sweeper
+from wire_format import JSON_CODEC
+from config import CHANGE_FEED_SIZE, CHANGES_DEFAULT_TIMEOUT, CHANGES_MAX_TIMEOUT, SSE_HEARTBEAT_SECONDS, SSE_RETRY_MS
+from config import (ROOM_CLEANUP_HOURS, BACKEND_MAX_ROOMS, BACKEND_MAX_PRIVATE_CHATS, MAX_PRIVATE_MESSAGES_PER_CHAT,
+                    ADMIN_TOKEN)
+from wire_format import DecodeError, get_codec, negotiate_subprotocol
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Idle rooms are evicted in the background, between requests
+    sweeper.start()
+    yield
+    sweeper.stop()
+
+app = FastAPI(title="PartyWatch Backend", lifespan=lifespan)
 
 # CORS for frontend
 app.add_middleware(
@@ -18,12 +36,33 @@ app.add_middleware(
 )
 
 # Mock data storage
-rooms_db: Dict[str, Dict] = {}
-chat_messages: Dict[str, List] = {}
+rooms_db: Dict[str, RoomInfo] = {}
+chat_messages: Dict[str, ChatLog] = {}
 private_chats: Dict[str, List] = {}  # Format: "user1_user2" -> messages
 sprint_boards: Dict[str, Dict] = {}  # Format: room_code -> board data
 meeting_notes: Dict[str, str] = {}   # Format: room_code -> notes
 
+def evict_room(room_code: str):
+    """Remove a room from every store, closing its sockets and event streams"""
+    rooms_db.pop(room_code, None)
+    chat_messages.pop(room_code, None)
+    private_chats.pop(f"{room_code}_private", None)
+    sprint_boards.pop(room_code, None)
+    meeting_notes.pop(room_code, None)
+    manager.drop_room(room_code)
+
+# Rooms idle for ROOM_CLEANUP_HOURS are swept, and the least recently active go first past the cap;
+# rooms with a socket or a waiting poll count as active
+room_retention = RetentionIndex(ROOM_CLEANUP_HOURS * 3600, BACKEND_MAX_ROOMS, evict_room, manager.in_use)
+private_chat_retention = RetentionIndex(ROOM_CLEANUP_HOURS * 3600, BACKEND_MAX_PRIVATE_CHATS,
+                                        lambda chat_key: private_chats.pop(chat_key, None))
+sweeper = Sweeper({"rooms": room_retention, "private_chats": private_chat_retention})
+
+def touch_room(room_code: str):
+    """Record activity on a room, if it exists"""
+    if room_code in rooms_db:
+        room_retention.touch(room_code)
+
 # Root endpoint for health check
 @app.get("/")
 async def root():
@@ -58,6 +97,9 @@ class JoinRoom(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
 
+class LeaveRoom(BaseModel):
+    user_id: str
+
 class SprintTask(BaseModel):
     room_code: str
     column: str  # "To Do", "In Progress", "Done"
@@ -76,21 +118,17 @@ class RoomUpdate(BaseModel):
 @app.post("/api/rooms")
 async def create_room(room_data: RoomCreate):
     """Create a new room"""
-    room = {
-        "room_code": room_data.room_code,
-        "host_id": room_data.host_id,
-        "video_id": room_data.video_id,
-        "spotify_url": room_data.spotify_url,
-        "room_name": room_data.room_name,
-        "room_type": room_data.room_type,
-        "users": [room_data.host_id],
-        "chat_messages": [],
-        "created_at": datetime.now().isoformat(),
-        "is_public": True,
-        "password": None
-    }
+    room = RoomInfo(
+        room_code=room_data.room_code,
+        host_id=room_data.host_id,
+        room_name=room_data.room_name,
+        room_type=room_data.room_type,
+        video_id=room_data.video_id,
+        spotify_url=room_data.spotify_url,
+        users=[room_data.host_id]
+    )
     rooms_db[room_data.room_code] = room
-    chat_messages[room_data.room_code] = []
+    chat_messages[room_data.room_code] = ChatLog()
     private_chats[f"{room_data.room_code}_private"] = []
     sprint_boards[room_data.room_code] = {
         "To Do": [],
@@ -98,14 +136,16 @@ async def create_room(room_data: RoomCreate):
         "Done": []
     }
     meeting_notes[room_data.room_code] = ""
-    return room
+    room_retention.touch(room_data.room_code)
+    return room.to_dict()
 
 @app.get("/api/rooms/{room_code}")
 async def get_room(room_code: str):
     """Get room information"""
     if room_code not in rooms_db:
         raise HTTPException(status_code=404, detail="Room not found")
-    return rooms_db[room_code]
+    touch_room(room_code)
+    return rooms_db[room_code].to_dict()
 
 @app.post("/api/rooms/{room_code}/join")
 async def join_room(room_code: str, join_data: JoinRoom):
@@ -114,23 +154,104 @@ async def join_room(room_code: str, join_data: JoinRoom):
         raise HTTPException(status_code=404, detail="Room not found")
     
     room = rooms_db[room_code]
-    if not room.get("is_public", True):
-        if not join_data.password or join_data.password != room.get("password"):
+    touch_room(room_code)
+    if not room.is_public:
+        if not join_data.password or join_data.password != room.password:
             raise HTTPException(status_code=403, detail="Incorrect password")
     
-    if join_data.user_id not in room["users"]:
-        room["users"].append(join_data.user_id)
+    if join_data.user_id not in room.users:
+        room.users.append(join_data.user_id)
+        manager.publish(room_code, {
+            "type": "user_joined",
+            "data": {"user_id": join_data.user_id, "username": join_data.username}
+        })
     
     return {
         "success": True,
-        "room_type": room.get("room_type"),
-        "video_id": room.get("video_id"),
-        "spotify_url": room.get("spotify_url"),
-        "room_desc": f"{room['room_type']} Room",
-        "is_public": room.get("is_public", True),
-        "password": room.get("password")
+        "room_type": room.room_type,
+        "video_id": room.video_id,
+        "spotify_url": room.spotify_url,
+        "room_desc": f"{room.room_type} Room",
+        "is_public": room.is_public,
+        "password": room.password
     }
 
+@app.post("/api/rooms/{room_code}/leave")
+async def leave_room(room_code: str, leave_data: LeaveRoom):
+    """Leave a room"""
+    if room_code not in rooms_db:
+        raise HTTPException(status_code=404, detail="Room not found")
+    
+    room = rooms_db[room_code]
+    touch_room(room_code)
+    if leave_data.user_id in room.users:
+        room.users.remove(leave_data.user_id)
+        manager.publish(room_code, {"type": "user_left", "data": {"user_id": leave_data.user_id}})
+    return {"success": True}
+
+@app.get("/api/rooms/{room_code}/changes")
+async def get_room_changes(room_code: str, cursor: Optional[int] = None,
+                           timeout: float = Query(CHANGES_DEFAULT_TIMEOUT, ge=0, le=CHANGES_MAX_TIMEOUT),
+                           limit: int = Query(CHANGE_FEED_SIZE, ge=1)):
+    """Long-poll a room's events after a cursor, waiting up to timeout seconds if there are none yet
+    
+    Returns {"events", "cursor", "reset"}: poll again from "cursor". Without
+    a cursor, returns the current one straight away. "reset" means events
+    were missed and the room should be refetched.
+    """
+    if room_code not in rooms_db:
+        raise HTTPException(status_code=404, detail="Room not found")
+    
+    touch_room(room_code)
+    feed = manager.feed(room_code)
+    if cursor is None:
+        return {"events": [], "cursor": feed.cursor, "reset": False}
+    return await feed.wait(cursor, timeout, limit)
+
+async def room_event_stream(feed: ChangeFeed, cursor: int) -> AsyncIterator[str]:
+    """Yield a room's events after a cursor as SSE messages, with a heartbeat comment while idle"""
+    yield f"retry: {SSE_RETRY_MS}\n\n"
+    while True:
+        await feed.wait_for(cursor, SSE_HEARTBEAT_SECONDS)
+        entries = feed.after(cursor, CHANGE_FEED_SIZE)
+        if feed.closed:
+            # The room was evicted; a reconnect gets a 404
+            return
+        if entries is None:
+            # Events were missed: the client refetches the room and resumes from the current cursor
+            cursor = feed.cursor
+            yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+        elif entries:
+            cursor = entries[-1][0]
+            yield ''.join(
+                f"id: {event_cursor}\nevent: {frame.message['type']}\ndata: {frame.encode(JSON_CODEC)}\n\n"
+                for event_cursor, frame in entries
+            )
+        else:
+            yield ": heartbeat\n\n"
+
+@app.get("/api/rooms/{room_code}/events")
+async def stream_room_events(room_code: str, last_event_id: Optional[int] = Header(None),
+                             cursor: Optional[int] = None):
+    """Stream a room's events as Server-Sent Events
+    
+    Each event's id is its change feed cursor, so a reconnecting
+    EventSource resumes through Last-Event-ID; clients that can't set
+    headers pass ?cursor= instead. Without either, only new events are sent.
+    """
+    if room_code not in rooms_db:
+        raise HTTPException(status_code=404, detail="Room not found")
+    
+    touch_room(room_code)
+    feed = manager.feed(room_code)
+    start = last_event_id if last_event_id is not None else cursor
+    return StreamingResponse(
+        room_event_stream(feed, feed.cursor if start is None else start),
+        media_type="text/event-stream",
+        # No caching, and no buffering in nginx-style proxies
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/rooms/{room_code}/update")
 async def update_room(room_code: str, update_data: RoomUpdate):
     """Update room information"""
@@ -138,12 +259,14 @@ async def update_room(room_code: str, update_data: RoomUpdate):
         raise HTTPException(status_code=404, detail="Room not found")
     
     room = rooms_db[room_code]
+    touch_room(room_code)
     if update_data.video_id is not None:
-        room["video_id"] = update_data.video_id
+        room.video_id = update_data.video_id
     if update_data.spotify_url is not None:
-        room["spotify_url"] = update_data.spotify_url
+        room.spotify_url = update_data.spotify_url
     
-    return {"success": True, "room": room}
+    manager.publish(room_code, {"type": "room_update", "data": room.to_dict()})
+    return {"success": True, "room": room.to_dict()}
 
 @app.post("/api/chat/messages")
 async def add_chat_message(message_data: ChatMessage):
@@ -151,26 +274,43 @@ async def add_chat_message(message_data: ChatMessage):
     if message_data.room_code not in rooms_db:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    message = {
-        "id": str(uuid.uuid4()),
-        "user_id": message_data.user_id,
-        "username": message_data.username,
-        "message": message_data.message,
-        "timestamp": datetime.now().isoformat()
-    }
+    message = ChatRecord(message_data.user_id, message_data.username, message_data.message)
     
     if message_data.room_code not in chat_messages:
-        chat_messages[message_data.room_code] = []
+        chat_messages[message_data.room_code] = ChatLog()
     
     chat_messages[message_data.room_code].append(message)
-    return message
+    touch_room(message_data.room_code)
+    manager.publish(message_data.room_code, {"type": "chat_message", "data": message.to_dict()})
+    return message.to_dict()
 
 @app.get("/api/chat/{room_code}/messages")
-async def get_chat_messages(room_code: str):
-    """Get chat messages for a room"""
-    if room_code not in chat_messages:
+async def get_chat_messages(room_code: str, after_id: Optional[str] = None, since: Optional[int] = None,
+                            before: Optional[int] = None, limit: Optional[int] = Query(None, ge=1)):
+    """Get chat messages for a room, oldest first
+    
+    after_id (a message id) or since (epoch ms) returns only newer messages,
+    for polling; before (a cursor) pages back through older ones. Without
+    either, the newest limit messages, or all of them.
+    """
+    log = chat_messages.get(room_code)
+    if log is None:
         return []
-    return chat_messages[room_code]
+    touch_room(room_code)
+    limit = limit or len(log)
+    
+    cursor = log.cursor_of(after_id) if after_id is not None else None
+    if cursor is not None:
+        start, end = log.after_range(cursor, limit)
+    elif since is not None:
+        start, end = log.since_range(since, limit)
+    elif before is not None:
+        start, end = log.page_range(before, limit)
+    else:
+        # Also the answer to an after_id no longer kept: the client resyncs from the newest page
+        start, end = log.recent_range(limit)
+    # Spliced from each message's cached encoding rather than serialized per request
+    return Response(log.encoded(start, end), media_type="application/json")
 
 # Private Chat Endpoints
 @app.post("/api/chat/private")
@@ -182,15 +322,19 @@ async def add_private_message(message_data: PrivateMessage):
         private_chats[chat_key] = []
     
     message = {
-        "id": str(uuid.uuid4()),
+        "id": new_id(),
         "sender_id": message_data.sender_id,
         "receiver_id": message_data.receiver_id,
         "sender_username": message_data.sender_username,
         "message": message_data.message,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": epoch_ms()
     }
     
-    private_chats[chat_key].append(message)
+    messages = private_chats[chat_key]
+    messages.append(message)
+    if len(messages) > MAX_PRIVATE_MESSAGES_PER_CHAT:
+        del messages[:len(messages) - MAX_PRIVATE_MESSAGES_PER_CHAT]
+    private_chat_retention.touch(chat_key)
     return message
 
 @app.get("/api/chat/private/{user1_id}/{user2_id}")
@@ -199,6 +343,7 @@ async def get_private_messages(user1_id: str, user2_id: str):
     chat_key = f"{min(user1_id, user2_id)}_{max(user1_id, user2_id)}"
     if chat_key not in private_chats:
         return []
+    private_chat_retention.touch(chat_key)
     return private_chats[chat_key]
 
 # Sprint Board Endpoints
@@ -209,13 +354,18 @@ async def add_sprint_task(task_data: SprintTask):
         raise HTTPException(status_code=404, detail="Room not found")
     
     task = {
-        "id": str(uuid.uuid4()),
+        "id": new_id(),
         "task": task_data.task,
         "user_id": task_data.user_id,
-        "created_at": datetime.now().isoformat()
+        "created_at": epoch_ms()
     }
     
     sprint_boards[task_data.room_code][task_data.column].append(task)
+    touch_room(task_data.room_code)
+    manager.publish(task_data.room_code, {
+        "type": "sprint_update",
+        "data": {"action": "add", "column": task_data.column, "task": task}
+    })
     return task
 
 @app.get("/api/sprint/{room_code}")
@@ -223,6 +373,7 @@ async def get_sprint_board(room_code: str):
     """Get sprint board for a room"""
     if room_code not in sprint_boards:
         return {"To Do": [], "In Progress": [], "Done": []}
+    touch_room(room_code)
     return sprint_boards[room_code]
 
 @app.put("/api/sprint/{room_code}/move")
@@ -237,6 +388,11 @@ async def move_task(room_code: str, task_id: str, from_column: str, to_column: s
             if task["id"] == task_id:
                 column.remove(task)
                 sprint_boards[room_code][to_column].append(task)
+                touch_room(room_code)
+                manager.publish(room_code, {
+                    "type": "sprint_update",
+                    "data": {"action": "move", "task_id": task_id, "from_column": from_column, "to_column": to_column}
+                })
                 return {"success": True}
     
     raise HTTPException(status_code=404, detail="Task not found")
@@ -249,6 +405,11 @@ async def update_meeting_notes(notes_data: MeetingNotes):
         raise HTTPException(status_code=404, detail="Room not found")
     
     meeting_notes[notes_data.room_code] = notes_data.notes
+    touch_room(notes_data.room_code)
+    manager.publish(notes_data.room_code, {
+        "type": "notes_update",
+        "data": {"notes": notes_data.notes, "user_id": notes_data.user_id}
+    })
     return {"success": True, "notes": notes_data.notes}
 
 @app.get("/api/meeting/notes/{room_code}")
@@ -256,47 +417,91 @@ async def get_meeting_notes(room_code: str):
     """Get meeting notes for a room"""
     if room_code not in meeting_notes:
         return {"notes": ""}
+    touch_room(room_code)
     return {"notes": meeting_notes[room_code]}
 
-# WebSocket endpoint for real-time features
+@app.get("/api/admin/memory")
+async def get_memory_usage(x_admin_token: Optional[str] = Header(None)):
+    """Get the size of the in-memory stores and what retention has evicted"""
+    if ADMIN_TOKEN and not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    
+    return {
+        "rooms": len(rooms_db),
+        "chat": {
+            "rooms": len(chat_messages),
+            "messages": sum(len(log) for log in chat_messages.values()),
+            "encoded_bytes": sum(log.encoded_bytes for log in chat_messages.values())
+        },
+        "private_chats": {
+            "chats": len(private_chats),
+            "messages": sum(len(messages) for messages in private_chats.values())
+        },
+        "sprint_tasks": sum(len(column) for board in sprint_boards.values() for column in board.values()),
+        "meeting_notes_chars": sum(len(notes) for notes in meeting_notes.values()),
+        "connections": manager.stats(),
+        "retention": sweeper.stats()
+    }
+
+async def send_ws_message(websocket: WebSocket, codec, message: Dict):
+    """Send a message in the connection's negotiated wire format"""
+    data = codec.encode(message)
+    if codec.binary:
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
+
+async def receive_ws_message(websocket: WebSocket, codec):
+    """Receive and decode the next message, returning (raw data, message)"""
+    event = await websocket.receive()
+    if event["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(event.get("code", 1000))
+    data = event.get("text") if event.get("text") is not None else event.get("bytes")
+    return data, codec.decode(data)
+
+# WebSocket endpoint for real-time features; REST mutations on the room are pushed here too
 @app.websocket("/ws/{room_code}")
-async def websocket_endpoint(websocket: WebSocket, room_code: str):
-    await websocket.accept()
+async def websocket_endpoint(websocket: WebSocket, room_code: str, user_id: Optional[str] = None):
+    # Binary codecs (msgpack/CBOR) are negotiated through the subprotocol, JSON otherwise
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    codec = get_codec(subprotocol)
+    await websocket.accept(subprotocol=subprotocol)
+    subscriber = manager.subscribe(websocket, room_code, codec, user_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            try:
+                data, message = await receive_ws_message(websocket, codec)
+            except DecodeError:
+                continue
             
             # Handle different message types
-            if message.get("type") == "chat_message":
-                # Broadcast chat message to all users in room
-                await websocket.send_text(json.dumps({
-                    "type": "chat_message",
+            if message.get("type") in ("chat_message", "sprint_update", "notes_update"):
+                # Broadcast to all users in room, the sender included
+                manager.publish(room_code, {
+                    "type": message["type"],
                     "data": message.get("data")
-                }))
+                })
             elif message.get("type") == "private_message":
-                # Send private message to specific user
-                await websocket.send_text(json.dumps({
+                # Send private message to the receiver's sockets, and the sender's
+                private = message.get("data") or {}
+                manager.publish(room_code, {
                     "type": "private_message",
-                    "data": message.get("data")
-                }))
-            elif message.get("type") == "sprint_update":
-                # Broadcast sprint board update
-                await websocket.send_text(json.dumps({
-                    "type": "sprint_update",
-                    "data": message.get("data")
-                }))
-            elif message.get("type") == "notes_update":
-                # Broadcast meeting notes update
-                await websocket.send_text(json.dumps({
-                    "type": "notes_update",
-                    "data": message.get("data")
-                }))
+                    "data": private
+                }, user_ids={private.get("receiver_id"), user_id} - {None})
+            elif codec.binary:
+                await send_ws_message(websocket, codec, {"type": "echo", "data": message})
             else:
                 # Echo back for other messages
                 await websocket.send_text(f"Echo: {data}")
+    except WebSocketDisconnect:
+        pass
     except Exception:
         await websocket.close()
+    finally:
+        manager.unsubscribe(subscriber)
+        if room_code not in rooms_db and not manager.in_use(room_code):
+            # A socket-only room leaves nothing behind
+            manager.drop_room(room_code)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,76 @@
+import asyncio
+import itertools
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from wire_format import Frame
+from config import CHANGE_FEED_SIZE
+
+class ChangeFeed:
+    """A room's recent events, numbered by cursor, that long-poll and SSE requests wait on
+
+    Events are kept as Frames, so every SSE stream sends the one encoding
+    the WebSocket fan-out already made. Events are appended from synchronous
+    code, so waiters park on an asyncio.Event that is set and replaced on
+    every append rather than on a Condition whose lock would have to be
+    awaited.
+    """
+
+    def __init__(self, capacity: int = CHANGE_FEED_SIZE):
+        self.events: deque = deque(maxlen=capacity)  # (cursor, frame)
+        self.cursor = 0  # cursor of the newest event
+        self.waiting = 0  # requests parked in wait_for, which keep the room from counting as idle
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def append(self, frame: Frame) -> int:
+        """Add an event and wake every waiter, returning its cursor"""
+        self.cursor += 1
+        self.events.append((self.cursor, frame))
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return self.cursor
+
+    def close(self):
+        """Release every waiter for good, once the room is gone"""
+        self.closed = True
+        self._changed.set()
+
+    def after(self, cursor: int, limit: int) -> Optional[List[Tuple[int, Frame]]]:
+        """Get up to limit (cursor, frame) events after a cursor, or None if some are no longer kept
+
+        None also answers a cursor from before a backend restart.
+        """
+        oldest = self.events[0][0] if self.events else self.cursor + 1
+        if cursor > self.cursor or cursor < oldest - 1:
+            return None
+        # Cursors are consecutive, so the first event wanted sits at a known offset
+        start = cursor + 1 - oldest
+        return list(itertools.islice(self.events, start, start + limit))
+
+    def changes(self, cursor: int, limit: int) -> Dict:
+        """Get up to limit events after a cursor, with the cursor to poll from next
+
+        'reset' is set when events after the cursor were missed; the client
+        should then refetch the room and carry on from the returned cursor.
+        """
+        entries = self.after(cursor, limit)
+        if entries is None:
+            return {'events': [], 'cursor': self.cursor, 'reset': True}
+        return {'events': [frame.message for _, frame in entries], 'cursor': cursor + len(entries), 'reset': False}
+
+    async def wait_for(self, cursor: int, timeout: float):
+        """Wait up to timeout seconds for an event after a cursor, returning at once if there is one"""
+        if cursor == self.cursor and timeout > 0 and not self.closed:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiting -= 1
+
+    async def wait(self, cursor: int, timeout: float, limit: int) -> Dict:
+        """Get the events after a cursor, waiting up to timeout seconds for one if there are none yet"""
+        await self.wait_for(cursor, timeout)
+        return self.changes(cursor, limit)
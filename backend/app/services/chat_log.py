@@ -0,0 +1,55 @@
+from typing import Dict, List, Optional, Tuple
+
+from chat_history import ChatHistory
+from records import ChatMessage
+from config import MAX_CHAT_MESSAGES_PER_ROOM
+
+class ChatLog(ChatHistory):
+    """A room's chat in cursor order, each message encoded once, indexed for polling
+
+    The WebSocket server's ChatHistory ring, so appending past capacity
+    overwrites the oldest slot and first_cursor moves up. Message ids and
+    timestamps are indexed alongside so a poll can resume from either.
+    """
+
+    def __init__(self, capacity: int = MAX_CHAT_MESSAGES_PER_ROOM):
+        super().__init__(capacity)
+        self._timestamps: List[int] = [0] * capacity  # slot -> timestamp, non-decreasing by cursor, for bisection
+        self._cursors: Dict[str, int] = {}  # message id -> cursor
+        self.encoded_bytes = 0  # size of the kept encodings, for memory accounting
+
+    def append(self, message: ChatMessage) -> int:
+        """Store a message under the next cursor, returning the cursor"""
+        slot = (self.last_cursor + 1) % self.capacity
+        if self._count == self.capacity:
+            # The slot holds the oldest message, about to be overwritten
+            self._cursors.pop(self._messages[slot].id, None)
+            self.encoded_bytes -= len(self._encoded[slot])
+        # A wall clock stepping back must not unsort the index; such a message is at worst sent twice
+        last_timestamp = self._timestamps[self.last_cursor % self.capacity] if self._count else message.timestamp
+        cursor = super().append(message)
+        self._timestamps[slot] = max(message.timestamp, last_timestamp)
+        self._cursors[message.id] = cursor
+        self.encoded_bytes += len(self._encoded[slot])
+        return cursor
+
+    def cursor_of(self, message_id: str) -> Optional[int]:
+        """Get the cursor of a message still kept"""
+        return self._cursors.get(message_id)
+
+    def after_range(self, cursor: int, limit: int) -> Tuple[int, int]:
+        """Get the cursor range of up to limit messages newer than a cursor"""
+        start = min(max(cursor + 1, self.first_cursor), self.last_cursor + 1)
+        return start, min(start + limit, self.last_cursor + 1)
+
+    def since_range(self, timestamp: int, limit: int) -> Tuple[int, int]:
+        """Get the cursor range of up to limit messages sent after a timestamp (epoch ms)"""
+        # Bisect over cursors rather than slots, since the ring's oldest slot moves
+        low, high = self.first_cursor, self.last_cursor + 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[middle % self.capacity] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return self.after_range(low - 1, limit)
@@ -0,0 +1,131 @@
+import asyncio
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from backend.app.services.change_feed import ChangeFeed
+from wire_format import Frame
+from config import OUTBOUND_QUEUE_HIGH_WATER
+
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try Again Later"
+ROOM_CLOSED_CLOSE_CODE = 1001  # "Going Away"
+
+class Subscriber:
+    """One WebSocket subscribed to a room, written by its own task so a publish never waits on a socket"""
+
+    def __init__(self, websocket: WebSocket, room_code: str, codec, user_id: Optional[str] = None):
+        self.websocket = websocket
+        self.room_code = room_code
+        self.codec = codec
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_HIGH_WATER)
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def send(self, frame: Frame) -> bool:
+        """Queue a frame in this subscriber's codec, returning False if it has fallen too far behind"""
+        try:
+            self.queue.put_nowait(frame.encode(self.codec))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _writer(self):
+        """Drain queued frames onto the socket"""
+        try:
+            while True:
+                data = await self.queue.get()
+                if self.codec.binary:
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+        except Exception:
+            # Socket gone; the endpoint unsubscribes when its receive loop ends
+            pass
+
+class ConnectionManager:
+    """Per-room subscriber sets with fan-out, shared by the WebSocket endpoint and the REST mutations
+
+    Room-wide events are also recorded on the room's change feed for
+    clients that long-poll instead of holding a socket.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Set[Subscriber]] = {}
+        self.feeds: Dict[str, ChangeFeed] = {}
+        self.counters = {'published': 0, 'delivered': 0, 'evicted': 0}
+
+    def subscribe(self, websocket: WebSocket, room_code: str, codec, user_id: Optional[str] = None) -> Subscriber:
+        """Start sending a room's events to an accepted socket"""
+        subscriber = Subscriber(websocket, room_code, codec, user_id)
+        self.rooms.setdefault(room_code, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        """Stop sending to a socket, forgetting the room once nobody is left in it"""
+        subscriber.writer_task.cancel()
+        subscribers = self.rooms.get(subscriber.room_code)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.rooms[subscriber.room_code]
+
+    def publish(self, room_code: str, message: Dict, user_ids: Optional[Set[str]] = None) -> int:
+        """Fan a message out to a room, or only to the given users in it, returning how many sockets got it"""
+        # Encoded at most once per codec in use, however many subscribers share it
+        frame = Frame(message)
+        if user_ids is None:
+            self.feed(room_code).append(frame)
+        subscribers = self.rooms.get(room_code)
+        if not subscribers:
+            return 0
+        self.counters['published'] += 1
+
+        delivered = 0
+        for subscriber in list(subscribers):
+            if user_ids is not None and subscriber.user_id not in user_ids:
+                continue
+            if subscriber.send(frame):
+                delivered += 1
+            else:
+                self._evict(subscriber)
+        self.counters['delivered'] += delivered
+        return delivered
+
+    def feed(self, room_code: str) -> ChangeFeed:
+        """Get a room's change feed, starting it if needed"""
+        feed = self.feeds.get(room_code)
+        if feed is None:
+            feed = self.feeds[room_code] = ChangeFeed()
+        return feed
+
+    def in_use(self, room_code: str) -> bool:
+        """Whether a socket is subscribed to a room or a request is waiting on its feed"""
+        feed = self.feeds.get(room_code)
+        return room_code in self.rooms or (feed is not None and feed.waiting > 0)
+
+    def drop_room(self, room_code: str):
+        """Forget a room's feed, ending its event streams, and close its sockets"""
+        feed = self.feeds.pop(room_code, None)
+        if feed is not None:
+            feed.close()
+        for subscriber in list(self.rooms.get(room_code, ())):
+            self.unsubscribe(subscriber)
+            asyncio.create_task(subscriber.websocket.close(ROOM_CLOSED_CLOSE_CODE))
+
+    def _evict(self, subscriber: Subscriber):
+        """Disconnect a subscriber whose queue is full"""
+        self.counters['evicted'] += 1
+        self.unsubscribe(subscriber)
+        asyncio.create_task(subscriber.websocket.close(SLOW_CONSUMER_CLOSE_CODE))
+
+    def stats(self) -> Dict:
+        """Get subscriber and fan-out counts"""
+        return {
+            'rooms': len(self.rooms),
+            'subscribers': sum(len(subscribers) for subscribers in self.rooms.values()),
+            'feeds': len(self.feeds),
+            'feed_events': sum(len(feed.events) for feed in self.feeds.values()),
+            **self.counters
+        }
+
+manager = ConnectionManager()
@@ -0,0 +1,121 @@
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from config import RETENTION_SWEEP_INTERVAL_SECONDS, RETENTION_SWEEP_BATCH
+
+class RetentionIndex:
+    """Last activity of each key in a store, least recently active first
+
+    Keys idle for longer than ttl seconds are evicted by the sweeper, and
+    touching a new key past max_entries evicts the least recently active
+    one straight away. Keys in use (per the in_use callback) are never
+    evicted; they count as active instead.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, evict: Callable[[str], None],
+                 in_use: Optional[Callable[[str], bool]] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict = evict  # removes the key's data from the stores
+        self.in_use = in_use
+        self.last_active: 'OrderedDict[str, float]' = OrderedDict()  # key -> time.monotonic()
+        self.counters = {'expired': 0, 'evicted_lru': 0}
+
+    def __len__(self) -> int:
+        return len(self.last_active)
+
+    def touch(self, key: str):
+        """Record activity on a key, evicting the least recently active keys if this one is new and over the cap"""
+        is_new = key not in self.last_active
+        self.last_active[key] = time.monotonic()
+        self.last_active.move_to_end(key)
+        if is_new and len(self.last_active) > self.max_entries:
+            self._evict_over_cap()
+
+    def forget(self, key: str):
+        """Stop tracking a key whose data is already gone"""
+        self.last_active.pop(key, None)
+
+    def _evict_over_cap(self):
+        """Evict least recently active keys down to max_entries, passing over keys in use"""
+        # Each key is looked at once at most, so a store full of keys in use is left over the cap
+        for key in list(itertools.islice(self.last_active, len(self.last_active) - 1)):
+            if len(self.last_active) <= self.max_entries:
+                break
+            if self.in_use is not None and self.in_use(key):
+                self.last_active.move_to_end(key)
+                continue
+            self._remove(key)
+            self.counters['evicted_lru'] += 1
+
+    def _remove(self, key: str):
+        del self.last_active[key]
+        self.evict(key)
+
+    def sweep(self, now: float, limit: int) -> int:
+        """Evict up to limit keys idle since before now - ttl, returning how many were looked at"""
+        deadline = now - self.ttl
+        expired: List[str] = []
+        for key, last_active in self.last_active.items():
+            if last_active > deadline or len(expired) >= limit:
+                break
+            expired.append(key)
+        for key in expired:
+            if self.in_use is not None and self.in_use(key):
+                self.last_active[key] = now
+                self.last_active.move_to_end(key)
+            else:
+                self._remove(key)
+                self.counters['expired'] += 1
+        return len(expired)
+
+    def stats(self) -> Dict:
+        """Get the key count, cap and eviction counts"""
+        return {'entries': len(self.last_active), 'max_entries': self.max_entries, 'ttl_seconds': self.ttl, **self.counters}
+
+class Sweeper:
+    """Background task that evicts idle keys from retention indexes
+
+    Evictions run in batches with a yield to the event loop between them,
+    so a sweep over many idle rooms never holds up request handling.
+    """
+
+    def __init__(self, indexes: Dict[str, RetentionIndex], interval: float = RETENTION_SWEEP_INTERVAL_SECONDS,
+                 batch: int = RETENTION_SWEEP_BATCH):
+        self.indexes = indexes
+        self.interval = interval
+        self.batch = batch
+        self.sweeps = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start sweeping every interval seconds"""
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop sweeping"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def sweep(self):
+        """Evict every key that is idle now, a batch at a time"""
+        for index in self.indexes.values():
+            while index.sweep(time.monotonic(), self.batch) == self.batch:
+                await asyncio.sleep(0)
+        self.sweeps += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Error sweeping idle data: {e}")
+
+    def stats(self) -> Dict:
+        """Get each index's stats and the number of sweeps run"""
+        return {'sweeps': self.sweeps, **{name: index.stats() for name, index in self.indexes.items()}}
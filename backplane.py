@@ -0,0 +1,233 @@
+"""
+PartyWatch Backplane
+Pub/sub relay that lets several WebSocket server instances share rooms
+"""
+
+import asyncio
+import uuid
+from typing import Callable, Dict, List, Optional, Set
+
+from wire_format import JSON_CODEC
+from config import BACKPLANE_CHANNEL_PREFIX
+
+EventHandler = Callable[[str, Dict], None]
+
+class Backplane:
+    """Publishes room events once per room channel and hands other nodes' events to the local server
+    
+    Every event is a dict with a 'kind' and is stamped with the publishing
+    node's id, so a node never handles its own events. Subclasses provide
+    the transport.
+    """
+    
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+        self.handler: Optional[EventHandler] = None
+        self.counters = {'published': 0, 'received': 0}
+        self._state_requests: Dict[str, Dict] = {}  # request_id -> {'replies', 'expected', 'done'}
+    
+    async def start(self, handler: EventHandler):
+        """Start delivering other nodes' events to a handler(room_code, event)"""
+        self.handler = handler
+    
+    async def close(self):
+        """Stop delivering events"""
+        self.handler = None
+    
+    async def subscribe(self, room_code: str):
+        """Start receiving a room's events"""
+        raise NotImplementedError
+    
+    def unsubscribe(self, room_code: str):
+        """Stop receiving a room's events"""
+        raise NotImplementedError
+    
+    def publish(self, room_code: str, event: Dict):
+        """Send an event to every other node subscribed to the room, without waiting"""
+        self.counters['published'] += 1
+        self._send(room_code, JSON_CODEC.encode({**event, 'node': self.node_id}))
+    
+    def _send(self, room_code: str, payload: str):
+        """Queue an encoded event on the room channel"""
+        raise NotImplementedError
+    
+    async def _send_counted(self, room_code: str, payload: str) -> int:
+        """Send an encoded event now, returning how many other nodes will receive it"""
+        raise NotImplementedError
+    
+    async def request_state(self, room_code: str, timeout: float) -> List[Dict]:
+        """Ask the other nodes in a room for their share of its state, waiting up to timeout seconds"""
+        request_id = uuid.uuid4().hex
+        request = self._state_requests[request_id] = {'replies': [], 'expected': 0, 'done': asyncio.Event()}
+        try:
+            self.counters['published'] += 1
+            request['expected'] = await self._send_counted(room_code, JSON_CODEC.encode({
+                'kind': 'state_request',
+                'request_id': request_id,
+                'node': self.node_id
+            }))
+            if request['expected'] > len(request['replies']):
+                try:
+                    await asyncio.wait_for(request['done'].wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            del self._state_requests[request_id]
+        return request['replies']
+    
+    def reply_state(self, room_code: str, request: Dict, state: Dict):
+        """Answer another node's state_request"""
+        self.publish(room_code, {'kind': 'state', 'request_id': request['request_id'], 'state': state})
+    
+    def _deliver(self, room_code: str, payload):
+        """Decode an event from the channel and route it"""
+        try:
+            event = JSON_CODEC.decode(payload)
+        except ValueError:
+            return
+        if event.get('node') == self.node_id:
+            return
+        self.counters['received'] += 1
+        
+        if event.get('kind') == 'state':
+            # Replies only matter to the node still waiting on that request
+            request = self._state_requests.get(event.get('request_id'))
+            if request is not None:
+                request['replies'].append(event['state'])
+                if len(request['replies']) >= request['expected']:
+                    request['done'].set()
+            return
+        
+        if self.handler is None:
+            return
+        try:
+            self.handler(room_code, event)
+        except Exception as e:
+            print(f"Error handling backplane event: {e}")
+
+class InProcessBus:
+    """Shared channel registry connecting InProcessBackplane nodes in one process"""
+    
+    def __init__(self):
+        self.subscribers: Dict[str, Set['InProcessBackplane']] = {}
+
+class InProcessBackplane(Backplane):
+    """Backplane over an in-memory bus, for tests and single-host setups"""
+    
+    def __init__(self, bus: InProcessBus, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        self.bus = bus
+    
+    async def subscribe(self, room_code: str):
+        """Start receiving a room's events"""
+        self.bus.subscribers.setdefault(room_code, set()).add(self)
+    
+    def unsubscribe(self, room_code: str):
+        """Stop receiving a room's events"""
+        subscribers = self.bus.subscribers.get(room_code)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.bus.subscribers[room_code]
+    
+    def _send(self, room_code: str, payload: str):
+        """Deliver on the next loop iteration, like a message arriving from the network"""
+        loop = asyncio.get_running_loop()
+        for node in self.bus.subscribers.get(room_code, ()):
+            if node is not self:
+                loop.call_soon(node._deliver, room_code, payload)
+    
+    async def _send_counted(self, room_code: str, payload: str) -> int:
+        """Send an encoded event now, returning how many other nodes will receive it"""
+        self._send(room_code, payload)
+        return len(self.bus.subscribers.get(room_code, set()) - {self})
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis pub/sub, one channel per room, using the backend's Redis connection"""
+    
+    def __init__(self, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        self.redis = None
+        self.pubsub = None
+        self.outbox: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    async def start(self, handler: EventHandler):
+        """Connect to Redis and start the publisher task"""
+        from backend.app.db import redis as redis_db
+        
+        await super().start(handler)
+        if redis_db.redis_client is None:
+            await redis_db.connect_to_redis()
+        self.redis = redis_db.redis_client
+        self.pubsub = self.redis.pubsub()
+        self.outbox = asyncio.Queue()
+        self._tasks.append(asyncio.create_task(self._publisher()))
+    
+    async def close(self):
+        """Stop the reader and publisher tasks and release the pub/sub connection"""
+        await super().close()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        if self.pubsub is not None:
+            await self.pubsub.reset()
+    
+    def _channel(self, room_code: str) -> str:
+        """Get the Redis channel carrying a room's events"""
+        return BACKPLANE_CHANNEL_PREFIX + room_code
+    
+    async def subscribe(self, room_code: str):
+        """Start receiving a room's events"""
+        await self.pubsub.subscribe(self._channel(room_code))
+        if len(self._tasks) == 1:
+            # The pub/sub connection only exists after the first subscribe
+            self._tasks.append(asyncio.create_task(self._reader()))
+    
+    def unsubscribe(self, room_code: str):
+        """Stop receiving a room's events"""
+        self.outbox.put_nowait(('unsubscribe', room_code))
+    
+    def _send(self, room_code: str, payload: str):
+        """Queue an encoded event; one publisher task keeps the room's events in order"""
+        self.outbox.put_nowait(('publish', room_code, payload))
+    
+    async def _send_counted(self, room_code: str, payload: str) -> int:
+        """Send an encoded event now, returning how many other nodes will receive it"""
+        receivers = await self.redis.publish(self._channel(room_code), payload)
+        return max(0, receivers - 1)  # this node is subscribed too
+    
+    async def _publisher(self):
+        """Send queued publishes and unsubscribes in order"""
+        while True:
+            command = await self.outbox.get()
+            try:
+                if command[0] == 'publish':
+                    await self.redis.publish(self._channel(command[1]), command[2])
+                else:
+                    await self.pubsub.unsubscribe(self._channel(command[1]))
+            except Exception as e:
+                print(f"Error publishing to backplane: {e}")
+    
+    async def _reader(self):
+        """Deliver messages from subscribed room channels"""
+        prefix_length = len(BACKPLANE_CHANNEL_PREFIX)
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error reading from backplane: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is not None and message['type'] == 'message':
+                self._deliver(message['channel'][prefix_length:], message['data'])
+
+def create_backplane(kind: str) -> Optional[Backplane]:
+    """Build the configured backplane ('' or 'none' for a standalone server)"""
+    if kind in ('', 'none'):
+        return None
+    if kind == 'redis':
+        return RedisBackplane()
+    raise ValueError(f"Unknown backplane: {kind}")
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for PartyWatch hot paths
+Run this to compare codec and server overheads on this machine
+"""
+
+import json
+import sys
+import timeit
+import tracemalloc
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from chat_history import ChatHistory
+from playback import server_time
+from rate_limit import RateLimiter
+from records import ChatMessage, Member, Room, new_id
+from wire_format import CODECS, JSON_CODEC, orjson
+
+def sample_messages():
+    """Build representative chat, playback and room_state messages"""
+    chat = {
+        'type': 'chat_message',
+        'message': {
+            'id': str(uuid.uuid4()),
+            'user_id': str(uuid.uuid4()),
+            'username': 'Alice',
+            'message': 'This scene is amazing, rewind 10 seconds!',
+            'timestamp': datetime.now().isoformat(),
+            'cursor': 42
+        },
+        'seq': 1234
+    }
+    playback = {
+        'type': 'playback_update',
+        'playback_state': {'playing': True, 'current_time': 1234.567, 'rate': 1.0, 'server_time': 98765432},
+        'seq': 1235
+    }
+    room_state = {
+        'type': 'room_state',
+        'your_id': str(uuid.uuid4()),
+        'seq': 1235,
+        'resume_token': 'x' * 22,
+        'room': {
+            'playback_state': playback['playback_state'],
+            'host_id': str(uuid.uuid4()),
+            'user_count': 50,
+            'users': [
+                {'id': str(uuid.uuid4()), 'username': f'user{i}', 'client_id': str(uuid.uuid4()), 'is_host': i == 0}
+                for i in range(50)
+            ],
+            'chat_messages': [dict(chat['message'], cursor=i) for i in range(20)],
+            'history_before': 1
+        }
+    }
+    return {'chat_message': chat, 'playback_update': playback, 'room_state': room_state}
+
+def time_per_call(func, number: int) -> float:
+    """Get the best per-call time in microseconds over a few repeats"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def bench_wire_formats(number: int = 2000):
+    """Compare encode/decode cost and bytes on the wire for each codec"""
+    print("🧪 Wire formats (µs per message, bytes on the wire)")
+    print(f"   orjson fast path: {'enabled' if orjson is not None else 'not installed'}")
+    
+    class StdlibJson:
+        subprotocol = 'json (stdlib baseline)'
+        encode = staticmethod(json.dumps)
+        decode = staticmethod(json.loads)
+    
+    codecs = [StdlibJson()] + list(CODECS)
+    print(f"   {'message':<16} {'codec':<24} {'encode':>8} {'decode':>8} {'bytes':>7}")
+    for name, message in sample_messages().items():
+        for codec in codecs:
+            encoded = codec.encode(message)
+            encode_us = time_per_call(lambda: codec.encode(message), number)
+            decode_us = time_per_call(lambda: codec.decode(encoded), number)
+            size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+            print(f"   {name:<16} {codec.subprotocol:<24} {encode_us:>8.2f} {decode_us:>8.2f} {size:>7}")
+    return True
+
+def bench_rate_limiter(number: int = 100000):
+    """Compare the limiter check with decoding the message it guards"""
+    print("🧪 Rate limiter (µs per incoming message)")
+    
+    # Enough headroom that the timed calls stay on the allowed path
+    limiter = RateLimiter(limits={'chat_message': (10 ** 9, 10 ** 9)})
+    client_ids = [str(uuid.uuid4()) for _ in range(1000)]
+    for client_id in client_ids:
+        limiter.check(client_id, 'chat_message')
+    frame = JSON_CODEC.encode(sample_messages()['chat_message'])
+    
+    # The server passes in the receive time it has already read
+    allowed_us = time_per_call(lambda: limiter.check(client_ids[500], 'chat_message', 1.0), number)
+    
+    # An exhausted bucket, as seen by a flooding client
+    flooded = RateLimiter(limits={'chat_message': (1, 1)})
+    flooded.check('flooder', 'chat_message', now=0.0)
+    throttled_us = time_per_call(lambda: flooded.check('flooder', 'chat_message', now=0.0), number)
+    decode_us = time_per_call(lambda: JSON_CODEC.decode(frame), number)
+    
+    print(f"   check, allowed:    {allowed_us:>8.3f}")
+    print(f"   check, throttled:  {throttled_us:>8.3f}")
+    print(f"   decode chat frame: {decode_us:>8.3f}")
+    print(f"   limiter overhead:  {allowed_us / decode_us * 100:>7.1f}% of decoding")
+    return True
+
+@dataclass
+class DictPlaybackState:
+    """PlaybackState as it was before it had slots"""
+    playing: bool = False
+    anchor_position: float = 0.0
+    anchor_time: float = field(default_factory=server_time)
+    rate: float = 1.0
+
+def dict_room() -> dict:
+    """A room in the free-form dict layout the server used before records"""
+    return {
+        'members': {},
+        'playback_state': DictPlaybackState(),
+        'chat': ChatHistory(),
+        'snapshot_cache': None,
+        'history_cache': {},
+        'host_id': None,
+        'host_client_id': None,
+        'playback_timer': None,
+        'pending_playback': None,
+        'seq': 0,
+        'replay': deque(maxlen=200),
+        'remote_members': {}
+    }
+
+def dict_member(room: dict, index: int):
+    """Add a member in the dict layout: UUID strings and an ISO timestamp"""
+    client_id = str(uuid.uuid4())
+    room['members'][client_id] = {
+        'id': str(uuid.uuid4()),
+        'username': f'user{index}',
+        'client_id': client_id,
+        'joined_at': datetime.now().isoformat(),
+        'is_host': index == 0
+    }
+
+def dict_chat_message(index: int) -> dict:
+    """A chat message in the dict layout"""
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': str(uuid.uuid4()),
+        'username': f'user{index}',
+        'message': 'This scene is amazing!',
+        'timestamp': datetime.now().isoformat(),
+        'cursor': index
+    }
+
+def record_member(room: Room, index: int):
+    """Add a member as a slotted record: compact IDs and epoch milliseconds"""
+    client_id = new_id()
+    room.members[client_id] = Member(new_id(), f'user{index}', client_id, is_host=index == 0)
+
+def record_chat_message(index: int) -> ChatMessage:
+    """A chat message as a slotted record"""
+    return ChatMessage(new_id(), f'user{index}', 'This scene is amazing!', cursor=index)
+
+def bench_memory(rooms: int = 10000, members: int = 5, messages: int = 20):
+    """Compare per-room, per-member and per-message footprint of dicts and slotted records"""
+    print(f"🧪 Memory at {rooms} rooms (bytes each)")
+    layouts = [
+        ('dicts', dict_room, dict_member, dict_chat_message),
+        ('records', Room, record_member, record_chat_message)
+    ]
+    
+    print(f"   {'layout':<10} {'room':>8} {'member':>8} {'message':>8} {'total MB':>9}")
+    for name, new_room, add_member, new_message in layouts:
+        # Each step's growth in traced memory is what it keeps alive
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            built = {f'ROOM{index:05d}': (new_room(), []) for index in range(rooms)}
+            after_rooms = tracemalloc.get_traced_memory()[0]
+            for room, _ in built.values():
+                for member in range(members):
+                    add_member(room, member)
+            after_members = tracemalloc.get_traced_memory()[0]
+            for _, chat in built.values():
+                chat.extend(new_message(cursor) for cursor in range(messages))
+            after_messages = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del built
+        
+        room_bytes = (after_rooms - start) / rooms
+        member_bytes = (after_members - after_rooms) / (rooms * members)
+        message_bytes = (after_messages - after_members) / (rooms * messages)
+        print(f"   {name:<10} {room_bytes:>8.0f} {member_bytes:>8.0f} {message_bytes:>8.0f} {(after_messages - start) / 1e6:>9.1f}")
+    return True
+
+def main():
+    """Run all benchmarks"""
+    print("🚀 PartyWatch Benchmarks")
+    print("=" * 50)
+    
+    benchmarks = [
+        bench_wire_formats,
+        bench_rate_limiter,
+        bench_memory
+    ]
+    
+    for benchmark in benchmarks:
+        benchmark()
+        print()
+    
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,65 @@
+"""
+PartyWatch Chat History
+Fixed-size ring of a room's recent chat, each message encoded once
+"""
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from wire_format import JSON_CODEC
+from config import MAX_CHAT_MESSAGES_PER_ROOM
+
+if TYPE_CHECKING:
+    from records import ChatMessage
+
+class ChatHistory:
+    """Ring buffer of the newest ChatMessage records, kept alongside their JSON encoding
+    
+    Cursors are consecutive, so a message's cursor also gives its slot and
+    ranges of messages are addressed by [start, end) cursors. Appending
+    overwrites the oldest slot once the ring is full.
+    """
+    
+    def __init__(self, capacity: int = MAX_CHAT_MESSAGES_PER_ROOM):
+        self.capacity = capacity
+        self._messages: List[Optional['ChatMessage']] = [None] * capacity
+        self._encoded: List[Optional[str]] = [None] * capacity
+        self._count = 0
+        self.last_cursor = 0  # cursor of the newest message, 0 before any
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def first_cursor(self) -> int:
+        """Cursor of the oldest message still kept (last_cursor + 1 when empty)"""
+        return self.last_cursor - self._count + 1
+    
+    def append(self, message: 'ChatMessage') -> int:
+        """Store a message under the next cursor, returning the cursor"""
+        self.last_cursor += 1
+        message.cursor = self.last_cursor
+        slot = self.last_cursor % self.capacity
+        self._messages[slot] = message
+        self._encoded[slot] = JSON_CODEC.encode(message.to_dict())
+        if self._count < self.capacity:
+            self._count += 1
+        return self.last_cursor
+    
+    def recent_range(self, count: int) -> Tuple[int, int]:
+        """Get the cursor range of the newest count messages"""
+        return max(self.first_cursor, self.last_cursor + 1 - count), self.last_cursor + 1
+    
+    def page_range(self, before: int, limit: int) -> Tuple[int, int]:
+        """Get the cursor range of up to limit messages older than a cursor"""
+        end = min(max(before, self.first_cursor), self.last_cursor + 1)
+        return max(self.first_cursor, end - limit), end
+    
+    def messages(self, start: int, end: int) -> List[Dict]:
+        """Get the messages in a cursor range as dicts, oldest first"""
+        capacity = self.capacity
+        return [self._messages[cursor % capacity].to_dict() for cursor in range(start, end)]
+    
+    def encoded(self, start: int, end: int) -> str:
+        """Get the messages in a cursor range as a JSON array, joined from their cached encodings"""
+        capacity = self.capacity
+        return '[' + ','.join([self._encoded[cursor % capacity] for cursor in range(start, end)]) + ']'
@@ -19,6 +19,15 @@ STREAMLIT_PORT = int(os.getenv('STREAMLIT_SERVER_PORT', 8501))
 STREAMLIT_HOST = os.getenv('STREAMLIT_SERVER_ADDRESS', 'localhost')
 WEBSOCKET_PORT = int(os.getenv('WEBSOCKET_PORT', 8765))
 WEBSOCKET_HOST = os.getenv('WEBSOCKET_HOST', 'localhost')
+WEBSOCKET_PUBLIC_HOST = os.getenv('WEBSOCKET_PUBLIC_HOST', WEBSOCKET_HOST)  # host put in redirect URLs
+WEBSOCKET_WORKERS = int(os.getenv('WEBSOCKET_WORKERS', 1))  # >1 shards rooms across processes
+WEBSOCKET_WORKER_BASE_PORT = int(os.getenv('WEBSOCKET_WORKER_BASE_PORT', WEBSOCKET_PORT + 1))  # worker i listens on base + i
+WEBSOCKET_SHARD_VIRTUAL_NODES = 160  # points per worker on the consistent hash ring
+
+# Backplane Configuration (rooms shared between server instances)
+WEBSOCKET_BACKPLANE = os.getenv('WEBSOCKET_BACKPLANE', '')  # 'redis' to relay rooms through REDIS_URL
+BACKPLANE_CHANNEL_PREFIX = 'partywatch:room:'
+BACKPLANE_STATE_TIMEOUT_MS = 250  # longest wait for other nodes' room state on a node's first join
 
 # Firebase Configuration
 FIREBASE_ENABLED = os.getenv('FIREBASE_ENABLED', 'false').lower() == 'true'
@@ -42,6 +51,8 @@ DEFAULT_VIDEO_QUALITY = 'medium'
 # Chat Configuration
 MAX_CHAT_MESSAGES_PER_ROOM = 100
 CHAT_MESSAGE_RATE_LIMIT = 5  # messages per minute per user
+JOIN_SNAPSHOT_CHAT_MESSAGES = 20  # recent messages sent with room_state, older ones via fetch_history
+CHAT_HISTORY_PAGE_SIZE = 50       # largest fetch_history page
 
 # Security Configuration
 SESSION_TIMEOUT_MINUTES = 60
@@ -68,6 +79,63 @@ YOUTUBE_EMBED_URL = "https://www.youtube.com/embed/{video_id}?enablejsapi=1&orig
 WEBSOCKET_PING_INTERVAL = 30  # seconds
 WEBSOCKET_PING_TIMEOUT = 10   # seconds
 WEBSOCKET_MAX_MESSAGE_SIZE = 1024 * 1024  # 1MB
+TIMER_WHEEL_TICK_MS = 500  # resolution of the shared heartbeat and resume timers
+TIMER_WHEEL_SLOTS = 512    # one revolution covers 256 seconds
+WEBSOCKET_COMPRESSION = os.getenv('WEBSOCKET_COMPRESSION', 'true').lower() == 'true'
+WEBSOCKET_DEFLATE_WINDOW_BITS = 11  # 2KB window instead of 32KB
+WEBSOCKET_DEFLATE_MEM_LEVEL = 4     # smaller zlib state per compressor
+WEBSOCKET_DEFLATE_LEVEL = 6
+COMPRESSED_FRAME_CACHE_BYTES = 4 * 1024 * 1024  # compressed broadcast frames shared across connections
+
+# Playback Sync Configuration
+PLAYBACK_COALESCE_WINDOW_MS = 75  # newest playback_update per room goes out at most once per window
+SCHEDULED_SYNC_MARGIN_MS = 50     # added to the room's worst RTT when scheduling play/seek
+SCHEDULED_SYNC_MIN_LEAD_MS = 100
+SCHEDULED_SYNC_MAX_LEAD_MS = 2000
+
+# Session Resume Configuration
+RESUME_GRACE_SECONDS = 30  # how long a dropped connection keeps its seat for a resume
+REPLAY_BUFFER_SIZE = 200   # room events kept per room for replay on resume
+
+# Restart Configuration (graceful drain on SIGTERM)
+ROOM_SNAPSHOT_PATH = os.getenv('ROOM_SNAPSHOT_PATH', 'room_snapshot.jsonl')  # sharded workers add '.<worker index>'
+ROOM_RESTORE_GRACE_SECONDS = 60  # a restored room nobody rejoins within this is dropped
+DRAIN_TIMEOUT_SECONDS = 10       # longest wait for clients to acknowledge the restart close
+
+# Outbound Queue Configuration (per connection)
+OUTBOUND_QUEUE_HIGH_WATER = 256  # pending frames before the slow-consumer policy kicks in
+OUTBOUND_QUEUE_DEFAULT_POLICY = 'fifo'
+OUTBOUND_QUEUE_POLICIES = {
+    'playback_update': 'latest',  # only the newest pending frame is kept
+    'chat_message': 'fifo',       # delivered in order, client disconnected past the high-water mark
+    'user_action': 'fifo',
+    'user_joined': 'fifo',
+    'user_left': 'fifo',
+    'room_state': 'fifo',
+    'throttled': 'latest'
+}
+
+# Backend Change Feed Configuration (long-poll GET /api/rooms/{code}/changes)
+CHANGE_FEED_SIZE = 256          # recent events kept per room; a client further behind resyncs
+CHANGES_DEFAULT_TIMEOUT = 25    # seconds a poll waits for the next event
+CHANGES_MAX_TIMEOUT = 60
+SSE_HEARTBEAT_SECONDS = 15      # comment line sent on an idle event stream so proxies keep it open
+SSE_RETRY_MS = 3000             # reconnect delay suggested to EventSource clients
+
+# Backend Retention Configuration (in-memory stores of backend/app/main.py)
+BACKEND_MAX_ROOMS = 1000                # least recently active rooms are evicted past this
+BACKEND_MAX_PRIVATE_CHATS = 5000        # likewise for private conversations
+MAX_PRIVATE_MESSAGES_PER_CHAT = 200
+RETENTION_SWEEP_INTERVAL_SECONDS = 60   # how often rooms idle for ROOM_CLEANUP_HOURS are swept
+RETENTION_SWEEP_BATCH = 100             # evictions between yields to request handling
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')  # when set, /api/admin/* requires it as X-Admin-Token
+
+# Metrics Configuration (Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))  # 0 disables; sharded worker i uses METRICS_PORT + i
+LOOP_LAG_SAMPLE_INTERVAL_MS = 250
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)  # seconds
+FANOUT_DURATION_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)  # seconds
 
 # Development Configuration
 DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
@@ -139,6 +207,14 @@ RATE_LIMITS = {
     'api_requests': 100      # requests per minute
 }
 
+# WebSocket message limits per connection: msg_type -> (burst, messages per minute)
+MESSAGE_RATE_LIMITS = {
+    'chat_message': (CHAT_MESSAGE_RATE_LIMIT, RATE_LIMITS['chat_messages']),
+    'user_action': (10, 60),
+    'playback_update': (30, 600)  # scrubbing sends bursts, coalesced before broadcast anyway
+}
+DEFAULT_MESSAGE_RATE_LIMIT = (RATE_LIMITS['api_requests'], RATE_LIMITS['api_requests'])  # every other type, together
+
 # Logging Configuration
 LOGGING_CONFIG = {
     'version': 1,
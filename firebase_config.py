@@ -6,6 +6,8 @@ import json
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from records import ChatMessage, Member, epoch_ms
+
 load_dotenv()
 
 class FirebaseManager:
@@ -61,11 +63,11 @@ class FirebaseManager:
                 'playback_state': {
                     'playing': False,
                     'current_time': 0,
-                    'last_updated': datetime.now().isoformat()
+                    'last_updated': epoch_ms()
                 },
                 'chat_messages': [],
-                'created_at': datetime.now().isoformat(),
-                'last_activity': datetime.now().isoformat()
+                'created_at': epoch_ms(),
+                'last_activity': epoch_ms()
             }
             
             self.db.child('rooms').child(room_code).set(room_data)
@@ -94,15 +96,10 @@ class FirebaseManager:
                 room_ref.child('users').set(users)
             
             # Add user info
-            user_info = {
-                'id': user_id,
-                'username': username,
-                'joined_at': datetime.now().isoformat(),
-                'is_host': user_id == room_data.get('host_id')
-            }
+            user_info = Member(user_id, username, is_host=user_id == room_data.get('host_id'))
             
-            room_ref.child('user_info').child(user_id).set(user_info)
-            room_ref.child('last_activity').set(datetime.now().isoformat())
+            room_ref.child('user_info').child(user_id).set(user_info.to_dict())
+            room_ref.child('last_activity').set(epoch_ms())
             
             return True
             
@@ -135,7 +132,7 @@ class FirebaseManager:
             if not users:
                 room_ref.delete()
             else:
-                room_ref.child('last_activity').set(datetime.now().isoformat())
+                room_ref.child('last_activity').set(epoch_ms())
             
             return True
             
@@ -160,7 +157,7 @@ class FirebaseManager:
             return False
         
         try:
-            playback_state['last_updated'] = datetime.now().isoformat()
+            playback_state['last_updated'] = epoch_ms()
             self.db.child('rooms').child(room_code).child('playback_state').set(playback_state)
             return True
         except Exception as e:
@@ -173,19 +170,13 @@ class FirebaseManager:
             return False
         
         try:
-            chat_message = {
-                'id': f"msg_{datetime.now().timestamp()}",
-                'user_id': user_id,
-                'username': username,
-                'message': message,
-                'timestamp': datetime.now().isoformat()
-            }
+            chat_message = ChatMessage(user_id, username, message)
             
             # Add message to chat
-            self.db.child('rooms').child(room_code).child('chat_messages').push(chat_message)
+            self.db.child('rooms').child(room_code).child('chat_messages').push(chat_message.to_dict())
             
             # Update last activity
-            self.db.child('rooms').child(room_code).child('last_activity').set(datetime.now().isoformat())
+            self.db.child('rooms').child(room_code).child('last_activity').set(chat_message.timestamp)
             
             return True
             
@@ -216,8 +207,7 @@ class FirebaseManager:
             return 0
         
         try:
-            from datetime import timedelta
-            cutoff_time = datetime.now() - timedelta(hours=max_inactive_hours)
+            cutoff_time = epoch_ms() - max_inactive_hours * 3600 * 1000
             
             rooms = self.db.child('rooms').get()
             if not rooms:
@@ -226,9 +216,11 @@ class FirebaseManager:
             cleaned_count = 0
             for room_code, room_data in rooms.items():
                 last_activity = room_data.get('last_activity')
+                if isinstance(last_activity, str):
+                    # Rooms written before timestamps were epoch milliseconds
+                    last_activity = int(datetime.fromisoformat(last_activity).timestamp() * 1000)
                 if last_activity:
-                    last_activity_dt = datetime.fromisoformat(last_activity)
-                    if last_activity_dt < cutoff_time:
+                    if last_activity < cutoff_time:
                         self.db.child('rooms').child(room_code).delete()
                         cleaned_count += 1
             
@@ -0,0 +1,129 @@
+"""
+PartyWatch Frame Compression
+permessage-deflate that compresses each broadcast frame once for every recipient
+"""
+
+import contextvars
+import dataclasses
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, OP_CONT, Frame
+
+from config import (
+    WEBSOCKET_DEFLATE_WINDOW_BITS,
+    WEBSOCKET_DEFLATE_MEM_LEVEL,
+    WEBSOCKET_DEFLATE_LEVEL,
+    COMPRESSED_FRAME_CACHE_BYTES
+)
+
+# Marker zlib leaves after a sync flush, stripped as RFC 7692 requires
+_EMPTY_UNCOMPRESSED_BLOCK = b"\x00\x00\xff\xff"
+
+# Set by a connection's writer around each send: True for frames fanned out to several sockets,
+# the only ones whose compressed form can be looked up again
+shared_frame = contextvars.ContextVar('shared_frame', default=False)
+
+class CompressedFrameCache:
+    """Byte-budgeted LRU of compressed payloads keyed by their uncompressed bytes"""
+    
+    def __init__(self, max_bytes: int = COMPRESSED_FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0  # one-off frames compressed without the cache
+        self._entries: OrderedDict = OrderedDict()  # (window_bits, payload) -> compressed
+    
+    def get(self, key: Tuple[int, bytes]) -> Optional[bytes]:
+        """Get a cached compressed payload, marking it recently used"""
+        compressed = self._entries.get(key)
+        if compressed is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return compressed
+    
+    def put(self, key: Tuple[int, bytes], compressed: bytes):
+        """Cache a compressed payload, evicting the least recently used ones over budget"""
+        cost = len(key[1]) + len(compressed)
+        if cost > self.max_bytes:
+            return
+        self._entries[key] = compressed
+        self.size += cost
+        while self.size > self.max_bytes:
+            (_, payload), evicted = self._entries.popitem(last=False)
+            self.size -= len(payload) + len(evicted)
+    
+    def stats(self) -> Dict:
+        """Get hit/miss counters, the hit rate and the memory in use"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'uncached': self.uncached
+        }
+
+# Shared by every connection of the process
+frame_cache = CompressedFrameCache()
+
+class SharedPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate without server context takeover, reusing compressed output across connections
+    
+    Without context takeover a message compresses the same way on every
+    connection with the same settings, so a frame fanned out to a room is
+    deflated once and the result is looked up for the other recipients.
+    It also means no connection keeps a compressor alive between messages.
+    Only frames the writer marks as shared go through the cache; a unicast
+    frame would never be looked up again and would only push out broadcasts.
+    """
+    
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES or frame.opcode is OP_CONT or not frame.fin \
+                or not self.local_no_context_takeover:
+            return super().encode(frame)
+        if not shared_frame.get():
+            frame_cache.uncached += 1
+            return super().encode(frame)
+        
+        key = (self.local_max_window_bits, frame.data)
+        data = frame_cache.get(key)
+        if data is None:
+            encoder = zlib.compressobj(wbits=-self.local_max_window_bits, **self.compress_settings)
+            data = encoder.compress(frame.data) + encoder.flush(zlib.Z_SYNC_FLUSH)
+            if data.endswith(_EMPTY_UNCOMPRESSED_BLOCK):
+                data = data[:-4]
+            frame_cache.put(key, data)
+        return dataclasses.replace(frame, rsv1=True, data=data)
+
+class SharedDeflateFactory(ServerPerMessageDeflateFactory):
+    """Server factory that negotiates SharedPerMessageDeflate"""
+    
+    def process_request_params(self, params: Sequence[Tuple[str, Optional[str]]],
+                               accepted_extensions: Sequence[Extension]):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, SharedPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings
+        )
+
+def deflate_extensions() -> list:
+    """Get the tuned extension list to pass to websockets.serve()"""
+    return [
+        SharedDeflateFactory(
+            server_no_context_takeover=True,
+            server_max_window_bits=WEBSOCKET_DEFLATE_WINDOW_BITS,
+            client_max_window_bits=WEBSOCKET_DEFLATE_WINDOW_BITS,
+            compress_settings={'memLevel': WEBSOCKET_DEFLATE_MEM_LEVEL, 'level': WEBSOCKET_DEFLATE_LEVEL}
+        )
+    ]
@@ -0,0 +1,188 @@
+"""
+PartyWatch Metrics
+Counters, gauges and histograms served in the Prometheus text format
+"""
+
+import asyncio
+import bisect
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import LOOP_LAG_SAMPLE_INTERVAL_MS, LOOP_LAG_BUCKETS, FANOUT_DURATION_BUCKETS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]  # (name suffix, labels, value)
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    """Format a sample value, with +Inf for the last bucket bound"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named family of samples, one per combination of label values"""
+    kind = 'untyped'
+    
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect  # called at scrape time instead of keeping values, for state the server already holds
+        self.values: Dict[Tuple, float] = {}
+    
+    def remove(self, *label_values):
+        """Drop the series for these label values"""
+        self.values.pop(label_values, None)
+    
+    def _label_pairs(self, label_values: Tuple) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.labels, label_values))
+    
+    def samples(self) -> Iterator[Sample]:
+        """Yield the family's current samples"""
+        values = self.collect() if self.collect is not None else self.values
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            yield '', self._label_pairs(label_values), value
+
+class Counter(Metric):
+    """Monotonically increasing total"""
+    kind = 'counter'
+    
+    def inc(self, *label_values, amount: float = 1):
+        """Add to the series for these label values"""
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+    kind = 'gauge'
+    
+    def set(self, value: float, *label_values):
+        """Set the series for these label values"""
+        self.values[label_values] = value
+
+class Histogram(Metric):
+    """Observations counted into fixed upper-bound buckets, plus their sum"""
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple, List] = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+    
+    def observe(self, value: float, *label_values):
+        """Count one observation into its bucket"""
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+    
+    def samples(self) -> Iterator[Sample]:
+        """Yield cumulative bucket counts, then the sum and count, per series"""
+        bounds = self.buckets + (float('inf'),)
+        for label_values, (counts, total) in self.values.items():
+            labels = self._label_pairs(label_values)
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield '_bucket', labels + (('le', _format_value(bound)),), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+class Registry:
+    """The metrics one endpoint serves"""
+    
+    def __init__(self):
+        self.metrics: List[Metric] = []
+    
+    def add(self, metric: Metric) -> Metric:
+        """Register a metric, returning it"""
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        """Get every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+                label_text = f"{{{label_text}}}" if label_text else ''
+                lines.append(f"{metric.name}{suffix}{label_text} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+class ServerMetrics:
+    """The WebSocket server's own instruments; gauges over server state are added by the server"""
+    
+    def __init__(self):
+        self.registry = Registry()
+        add = self.registry.add
+        self.messages_in = add(Counter('partywatch_messages_received_total', 'Client messages received', ('type',)))
+        self.bytes_in = add(Counter('partywatch_received_bytes_total', 'Size of client messages received (characters for text frames)', ('type',)))
+        self.messages_out = add(Counter('partywatch_messages_sent_total', 'Frames queued to clients', ('type',)))
+        self.bytes_out = add(Counter('partywatch_sent_bytes_total', 'Size of frames queued to clients (characters for text frames)', ('type',)))
+        self.fanout_seconds = add(Histogram('partywatch_fanout_duration_seconds', 'Time to hand one room event to every local member',
+                                            FANOUT_DURATION_BUCKETS, ('room',)))
+        self.loop_lag_seconds = add(Histogram('partywatch_event_loop_lag_seconds', 'How late the event loop woke a sleeping task',
+                                              LOOP_LAG_BUCKETS))
+        self.loop_lag = add(Gauge('partywatch_event_loop_lag_last_seconds', 'Most recent event loop lag sample'))
+        self._lag_task: Optional[asyncio.Task] = None
+    
+    def received(self, msg_type: str, size: int):
+        """Count a message from a client"""
+        self.messages_in.inc(msg_type)
+        self.bytes_in.inc(msg_type, amount=size)
+    
+    def sent(self, msg_type: str, size: int):
+        """Count a frame queued to a client"""
+        self.messages_out.inc(msg_type)
+        self.bytes_out.inc(msg_type, amount=size)
+    
+    def start(self, interval: float = LOOP_LAG_SAMPLE_INTERVAL_MS / 1000):
+        """Start sampling event loop lag"""
+        self._lag_task = asyncio.create_task(self._sample_loop_lag(interval))
+    
+    def stop(self):
+        """Stop sampling event loop lag"""
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+    
+    async def _sample_loop_lag(self, interval: float):
+        """Sleep for a fixed interval and record how much later than asked the loop woke us"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag.set(lag)
+            self.loop_lag_seconds.observe(lag)
+
+async def serve_metrics(registry: Registry, host: str, port: int) -> asyncio.AbstractServer:
+    """Serve GET /metrics over plain HTTP/1.0"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass  # headers are not needed
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type, body = '200 OK', CONTENT_TYPE, registry.render().encode()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    return await asyncio.start_server(handle, host, port)
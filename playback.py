@@ -0,0 +1,153 @@
+"""
+PartyWatch Playback Timeline
+Server-authoritative playback state for watch rooms
+"""
+
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+def server_time() -> float:
+    """Read the server clock used to anchor playback (monotonic seconds)"""
+    return time.monotonic()
+
+def client_number(value, name: str) -> float:
+    """Check a number sent by a client, raising ValueError for strings, booleans and non-finite values"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    return float(value)
+
+def to_wire_time(timestamp: float) -> int:
+    """Convert a server clock reading to the integer milliseconds sent to clients"""
+    return round(timestamp * 1000)
+
+class ClockEstimate:
+    """Running clock offset and RTT estimate for one connection, from NTP-style exchanges
+    
+    Each exchange has four timestamps: t0 client send, t1 server receive,
+    t2 server send, t3 client receive. The offset is server clock minus
+    client clock, taken from the lowest-RTT sample in a short window since
+    those carry the least queueing error.
+    """
+    
+    WINDOW = 8
+    RTT_GAIN = 0.125     # smoothing for the RTT average
+    JITTER_GAIN = 0.25   # smoothing for the RTT mean deviation
+    
+    def __init__(self):
+        self.samples: deque = deque(maxlen=self.WINDOW)  # (rtt_ms, offset_ms)
+        self.sample_count = 0
+        self.offset_ms: Optional[float] = None
+        self.rtt_ms: Optional[float] = None
+        self.jitter_ms = 0.0
+        self.pending: Optional[Tuple[float, int, int]] = None  # (t0, t1, t2) awaiting the client's t3
+    
+    def add_sample(self, t0: float, t1: float, t2: float, t3: float) -> bool:
+        """Fold a completed exchange into the estimate, ignoring impossible samples"""
+        rtt = (t3 - t0) - (t2 - t1)
+        if rtt < 0:
+            return False
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        
+        if self.rtt_ms is None:
+            self.rtt_ms = rtt
+            self.jitter_ms = rtt / 2
+        else:
+            self.jitter_ms += self.JITTER_GAIN * (abs(rtt - self.rtt_ms) - self.jitter_ms)
+            self.rtt_ms += self.RTT_GAIN * (rtt - self.rtt_ms)
+        
+        self.samples.append((rtt, offset))
+        self.sample_count += 1
+        self.offset_ms = min(self.samples)[1]
+        return True
+    
+    def one_way_delay(self) -> float:
+        """Get the estimated server-to-client delay in seconds (0 until measured)"""
+        return (self.rtt_ms or 0.0) / 2000
+    
+    def stats(self) -> Dict:
+        """Get the current estimate for diagnostics"""
+        return {
+            'offset_ms': self.offset_ms,
+            'rtt_ms': self.rtt_ms,
+            'jitter_ms': self.jitter_ms if self.rtt_ms is not None else None,
+            'samples': self.sample_count
+        }
+
+@dataclass(slots=True)
+class PlaybackState:
+    """Playback as an anchor point; the current position is derived on demand"""
+    playing: bool = False
+    anchor_position: float = 0.0  # media position in seconds at anchor_time
+    anchor_time: float = field(default_factory=server_time)
+    rate: float = 1.0
+    
+    def position(self, now: Optional[float] = None) -> float:
+        """Get the media position at a server time (defaults to now)"""
+        if now is None:
+            now = server_time()
+        if not self.playing or now <= self.anchor_time:
+            return self.anchor_position
+        return self.anchor_position + (now - self.anchor_time) * self.rate
+    
+    def apply(self, update: Dict, now: Optional[float] = None) -> bool:
+        """Apply a client state transition, returning True on a play/pause edge
+        
+        A malformed update raises ValueError and leaves the timeline as it was.
+        """
+        if now is None:
+            now = server_time()
+        if not isinstance(update, dict):
+            raise ValueError(f"Invalid playback state: {update!r}")
+        
+        position = update.get('current_time')
+        position = self.position(now) if position is None else client_number(position, 'current_time')
+        playing = update.get('playing', self.playing)
+        if not isinstance(playing, bool):
+            raise ValueError(f"Invalid playing flag: {playing!r}")
+        rate = client_number(update.get('rate', self.rate), 'playback rate')
+        if rate <= 0:
+            raise ValueError(f"Invalid playback rate: {rate}")
+        
+        is_edge = playing != self.playing
+        self.set_anchor(playing, position, now, rate)
+        return is_edge
+    
+    def set_anchor(self, playing: bool, position: float, at: float, rate: Optional[float] = None):
+        """Re-anchor the timeline; an anchor in the future schedules the transition for that time"""
+        self.playing = playing
+        self.anchor_position = max(0.0, position)
+        self.anchor_time = at
+        if rate is not None:
+            self.rate = rate
+    
+    def to_shared(self) -> Dict:
+        """Get the state for other server nodes, anchored on the wall clock since monotonic clocks are per host"""
+        return {
+            'playing': self.playing,
+            'anchor_position': self.anchor_position,
+            'anchor_wall_time': time.time() + (self.anchor_time - server_time()),
+            'rate': self.rate
+        }
+    
+    def load_shared(self, shared: Dict):
+        """Adopt a state from another server node"""
+        anchor_time = server_time() + (shared['anchor_wall_time'] - time.time())
+        self.set_anchor(shared['playing'], shared['anchor_position'], anchor_time, shared['rate'])
+    
+    def to_wire(self, now: Optional[float] = None) -> Dict:
+        """Get the state as sent to clients: the position at the given server time"""
+        if now is None:
+            now = server_time()
+        state = {
+            'playing': self.playing,
+            'current_time': self.position(now),
+            'rate': self.rate,
+            'server_time': to_wire_time(now)
+        }
+        if self.anchor_time > now:
+            # A scheduled transition has not happened yet
+            state['starts_at'] = to_wire_time(self.anchor_time)
+        return state
@@ -0,0 +1,79 @@
+"""
+PartyWatch Rate Limiting
+Token buckets per client and message type, checked before a message is handled
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from playback import server_time
+from config import MESSAGE_RATE_LIMITS, DEFAULT_MESSAGE_RATE_LIMIT
+
+DEFAULT_BUCKET = '*'  # shared by every message type without its own limit
+
+class MemoryBucketStore:
+    """Token buckets in a dict, shared by every connection of one server process
+    
+    Any object with the same take/forget methods can stand in for it, for
+    instance to share buckets between processes.
+    """
+    
+    def __init__(self):
+        self._buckets: Dict[str, Dict[str, List[float]]] = {}  # key -> bucket name -> [tokens, updated]
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+    
+    def take(self, key: str, bucket_name: str, capacity: float, rate: float, now: float) -> float:
+        """Take a token, returning 0 on success or the seconds until one is available"""
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = {}
+        bucket = buckets.get(bucket_name)
+        if bucket is None:
+            # New buckets start full
+            buckets[bucket_name] = [capacity - 1, now]
+            return 0.0
+        
+        # Plain comparisons rather than min(), this runs for every incoming message
+        tokens = bucket[0] + (now - bucket[1]) * rate
+        if tokens > capacity:
+            tokens = capacity
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+    
+    def forget(self, key: str):
+        """Drop every bucket of a key"""
+        self._buckets.pop(key, None)
+
+class RateLimiter:
+    """Per-key token-bucket limits by message type"""
+    
+    def __init__(self, limits: Dict[str, Tuple[int, int]] = None,
+                 default: Tuple[int, int] = DEFAULT_MESSAGE_RATE_LIMIT, store=None):
+        limits = MESSAGE_RATE_LIMITS if limits is None else limits
+        # (burst, per minute) -> (capacity, tokens per second)
+        self.limits = {msg_type: (burst, per_minute / 60) for msg_type, (burst, per_minute) in limits.items()}
+        self.limits[DEFAULT_BUCKET] = (default[0], default[1] / 60)
+        self.store = store if store is not None else MemoryBucketStore()
+        self.throttled: Dict[str, int] = {}  # bucket name -> messages refused
+    
+    def check(self, key: str, msg_type: Optional[str], now: Optional[float] = None) -> float:
+        """Count a message against its bucket, returning 0 if allowed or the seconds to wait"""
+        limit = self.limits.get(msg_type)
+        if limit is None:
+            msg_type = DEFAULT_BUCKET
+            limit = self.limits[DEFAULT_BUCKET]
+        if now is None:
+            now = server_time()
+        retry_after = self.store.take(key, msg_type, limit[0], limit[1], now)
+        if retry_after:
+            self.throttled[msg_type] = self.throttled.get(msg_type, 0) + 1
+        return retry_after
+    
+    def forget(self, key: str):
+        """Drop a key's buckets once its client is gone"""
+        self.store.forget(key)
@@ -0,0 +1,123 @@
+"""
+PartyWatch Records
+Slotted room, member and chat records shared by the WebSocket server and the backend
+"""
+
+import asyncio
+import secrets
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from chat_history import ChatHistory
+from playback import PlaybackState
+from room_actor import RoomActor
+from config import REPLAY_BUFFER_SIZE
+
+def new_id() -> str:
+    """Random 12-character URL-safe ID (72 bits), a third of the size of a UUID string"""
+    return secrets.token_urlsafe(9)
+
+def epoch_ms() -> int:
+    """Current wall-clock time in integer milliseconds since the epoch"""
+    return time.time_ns() // 1_000_000
+
+@dataclass(slots=True)
+class Member:
+    """One connection's seat in a room"""
+    id: str
+    username: str
+    client_id: Optional[str] = None  # None where members aren't tied to a socket
+    is_host: bool = False
+    joined_at: int = field(default_factory=epoch_ms)
+    
+    def to_dict(self) -> Dict:
+        """Get the member as sent to clients"""
+        return {
+            'id': self.id,
+            'username': self.username,
+            'client_id': self.client_id,
+            'is_host': self.is_host,
+            'joined_at': self.joined_at
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Member':
+        """Rebuild a member from its dict form"""
+        return cls(data['id'], data['username'], data.get('client_id'),
+                   data.get('is_host', False), data.get('joined_at') or epoch_ms())
+
+@dataclass(slots=True)
+class ChatMessage:
+    """A room chat message; cursor orders it within the room's history"""
+    user_id: str
+    username: str
+    message: str
+    id: str = field(default_factory=new_id)
+    timestamp: int = field(default_factory=epoch_ms)
+    cursor: int = 0
+    
+    def to_dict(self) -> Dict:
+        """Get the message as sent to clients"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'username': self.username,
+            'message': self.message,
+            'timestamp': self.timestamp,
+            'cursor': self.cursor
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ChatMessage':
+        """Rebuild a message from its dict form"""
+        return cls(data['user_id'], data['username'], data['message'],
+                   data.get('id') or new_id(), data.get('timestamp') or epoch_ms(), data.get('cursor', 0))
+
+@dataclass(slots=True)
+class Room:
+    """Live state of a watch room on one WebSocket server"""
+    members: Dict[str, Member] = field(default_factory=dict)  # client_id -> member, in join order
+    remote_members: Dict[str, Member] = field(default_factory=dict)  # members connected to other nodes
+    playback_state: PlaybackState = field(default_factory=PlaybackState)
+    chat: ChatHistory = field(default_factory=ChatHistory)  # recent messages, with cursors for fetch_history paging
+    chat_snapshot: Dict = field(default_factory=dict)  # chat part of room_state per codec subprotocol, cleared when the chat changes
+    user_fragments: Dict[str, Tuple] = field(default_factory=dict)  # client_id -> (member, is_host, its JSON room_state entry)
+    history_cache: Dict = field(default_factory=dict)  # (subprotocol, before, limit) -> encoded chat_history frame
+    host_id: Optional[str] = None
+    host_client_id: Optional[str] = None
+    playback_timer: Optional[asyncio.TimerHandle] = None  # open coalescing window, if any
+    pending_playback: Optional[str] = None  # sender client_id of an update held for the window's end
+    seq: int = 0  # sequence number of the last room event
+    replay: deque = field(default_factory=lambda: deque(maxlen=REPLAY_BUFFER_SIZE))  # (seq, excluded client_id, msg_type, frame)
+    actor: Optional[RoomActor] = None  # runs every step that touches the room, in order
+
+@dataclass(slots=True)
+class RoomInfo:
+    """A room as created through the backend API"""
+    room_code: str
+    host_id: str
+    room_name: str
+    room_type: str
+    video_id: Optional[str] = None
+    spotify_url: Optional[str] = None
+    users: List[str] = field(default_factory=list)
+    created_at: int = field(default_factory=epoch_ms)
+    is_public: bool = True
+    password: Optional[str] = None
+    
+    def to_dict(self) -> Dict:
+        """Get the room as returned by the API"""
+        return {
+            'room_code': self.room_code,
+            'host_id': self.host_id,
+            'video_id': self.video_id,
+            'spotify_url': self.spotify_url,
+            'room_name': self.room_name,
+            'room_type': self.room_type,
+            'users': self.users,
+            'created_at': self.created_at,
+            'is_public': self.is_public,
+            'password': self.password
+        }
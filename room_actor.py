@@ -0,0 +1,101 @@
+"""
+PartyWatch Room Actors
+One task per room, running everything that touches the room in arrival order
+"""
+
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Optional
+
+class RoomActor:
+    """Mailbox and task that run a room's steps one at a time
+    
+    A step is any callable; a coroutine it returns is awaited before the
+    next step starts, so nothing else in the room can interleave with it.
+    CPU time is counted for the synchronous part of each step only. Once
+    stopped, the actor takes no more steps: tell drops them and ask returns
+    None, so nothing waits on a step that will never run.
+    """
+    
+    def __init__(self, room_code: str):
+        self.room_code = room_code
+        self.mailbox: asyncio.Queue = asyncio.Queue()
+        self.cpu_time = 0.0
+        self.processed = 0
+        self.max_depth = 0
+        self.stopped = False
+        self.task = asyncio.create_task(self._run())
+    
+    def tell(self, step: Callable, *args):
+        """Queue step(*args) without waiting for it"""
+        if self.stopped:
+            return
+        self._put((step, args, None))
+    
+    async def ask(self, step: Callable, *args) -> Any:
+        """Queue step(*args) and wait for its result, None if the actor has stopped"""
+        if self.stopped:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._put((step, args, future))
+        return await future
+    
+    def _put(self, item: Optional[tuple]):
+        """Add to the mailbox, tracking its high-water mark"""
+        self.mailbox.put_nowait(item)
+        depth = self.mailbox.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+    
+    def stop(self):
+        """End the task once the steps already queued have run"""
+        if not self.stopped:
+            self.stopped = True
+            self.mailbox.put_nowait(None)
+    
+    def stats(self) -> Dict:
+        """Get the room's CPU time and mailbox depth"""
+        return {
+            'cpu_ms': round(self.cpu_time * 1000, 3),
+            'processed': self.processed,
+            'queue_depth': self.mailbox.qsize(),
+            'max_queue_depth': self.max_depth
+        }
+    
+    async def _run(self):
+        """Run queued steps until stopped"""
+        try:
+            await self._run_steps()
+        finally:
+            # Whatever is left never runs; its askers get None instead of waiting forever
+            self.stopped = True
+            while not self.mailbox.empty():
+                item = self.mailbox.get_nowait()
+                if item is not None and item[2] is not None and not item[2].done():
+                    item[2].set_result(None)
+    
+    async def _run_steps(self):
+        """Run queued steps until the stop sentinel"""
+        while True:
+            item = await self.mailbox.get()
+            if item is None:
+                return
+            step, args, future = item
+            try:
+                started = time.thread_time()
+                try:
+                    result = step(*args)
+                finally:
+                    self.cpu_time += time.thread_time() - started
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                if future is None:
+                    print(f"Error in room {self.room_code}: {e}")
+                elif not future.done():
+                    future.set_exception(e)
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
+            self.processed += 1
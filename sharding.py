@@ -0,0 +1,61 @@
+"""
+PartyWatch Sharding
+Consistent hashing of rooms onto WebSocket worker processes
+"""
+
+import bisect
+import hashlib
+from typing import Dict, List, Sequence
+
+from config import WEBSOCKET_SHARD_VIRTUAL_NODES
+
+def _hash(key: str) -> int:
+    """Stable 64-bit hash, identical in every worker process"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring with virtual nodes, so adding a worker only moves ~1/N of the rooms"""
+    
+    def __init__(self, nodes: Sequence[str], virtual_nodes: int = WEBSOCKET_SHARD_VIRTUAL_NODES):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+    
+    def node_for(self, key: str) -> str:
+        """Get the node owning a key"""
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+class ShardMap:
+    """Which worker owns which room, as seen from one worker"""
+    
+    def __init__(self, worker_urls: List[str], worker_index: int):
+        self.worker_urls = worker_urls
+        self.worker_index = worker_index
+        self.ring = HashRing(worker_urls)
+    
+    @property
+    def url(self) -> str:
+        return self.worker_urls[self.worker_index]
+    
+    def owner_url(self, room_code: str) -> str:
+        """Get the URL of the worker serving a room"""
+        return self.ring.node_for(room_code)
+    
+    def owns(self, room_code: str) -> bool:
+        """Check whether this worker serves a room"""
+        return self.owner_url(room_code) == self.url
+    
+    def distribution(self, room_codes: Sequence[str]) -> Dict[str, int]:
+        """Count how many of the given rooms land on each worker"""
+        counts = {url: 0 for url in self.worker_urls}
+        for room_code in room_codes:
+            counts[self.owner_url(room_code)] += 1
+        return counts
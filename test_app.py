@@ -10,6 +10,7 @@ import time
 import subprocess
 import sys
 import os
+import tempfile
 
 def test_backend():
     """Test backend API endpoints"""
@@ -143,6 +144,795 @@ def test_dependencies():
     print("🎉 All dependencies available!")
     return True
 
+async def _join_sharded_room(front_url, room_code, user_id):
+    """Join a room through the public port, following the worker redirect"""
+    import websockets
+    
+    url = front_url
+    for _ in range(2):
+        ws = await websockets.connect(url)
+        await ws.send(json.dumps({"room_code": room_code, "user_id": user_id, "username": user_id}))
+        reply = json.loads(await ws.recv())
+        if reply["type"] != "redirect":
+            return ws, reply
+        await ws.close()
+        url = reply["url"]
+    raise RuntimeError(f"Redirect loop for room {room_code}")
+
+async def _check_sharded_rooms(front_url, shard_map):
+    """Check room affinity and isolation against running workers"""
+    import asyncio
+    import websockets
+    
+    # Each worker serves the rooms the hash ring assigns it and redirects the rest to their owner
+    rooms = [f"ROOM{i:04d}" for i in range(12)]
+    served_by = {}
+    for room_code in rooms:
+        owner = shard_map.owner_url(room_code)
+        for worker_url in shard_map.worker_urls:
+            ws = await websockets.connect(worker_url)
+            await ws.send(json.dumps({"room_code": room_code, "user_id": "probe", "username": "probe"}))
+            reply = json.loads(await ws.recv())
+            await ws.close()
+            expected = "room_state" if worker_url == owner else "redirect"
+            if reply["type"] != expected or (expected == "redirect" and reply["url"] != owner):
+                print(f"❌ Worker {worker_url} answered {reply['type']} for room {room_code} owned by {owner}")
+                return False
+        served_by[room_code] = owner
+    print(f"✅ {len(rooms)} rooms routed to their owning workers")
+    
+    if len(set(served_by.values())) < 2:
+        print("❌ All rooms landed on a single worker")
+        return False
+    print(f"✅ Rooms spread over {len(set(served_by.values()))} workers")
+    
+    # Members joining through the public port meet on one worker, and other rooms don't see their chat
+    alice, _ = await _join_sharded_room(front_url, "SHARDA01", "alice")
+    bob, _ = await _join_sharded_room(front_url, "SHARDA01", "bob")
+    carol, _ = await _join_sharded_room(front_url, "SHARDB02", "carol")
+    
+    await alice.send(json.dumps({"type": "chat_message", "user_id": "alice", "username": "alice", "message": "hi"}))
+    
+    async def wait_for_chat(ws):
+        while True:
+            message = json.loads(await ws.recv())
+            if message["type"] == "chat_message":
+                return message
+    
+    try:
+        await asyncio.wait_for(wait_for_chat(bob), 2)
+    except asyncio.TimeoutError:
+        print("❌ Members of one room were split across workers")
+        return False
+    try:
+        await asyncio.wait_for(wait_for_chat(carol), 0.5)
+        print("❌ Chat leaked into another room")
+        return False
+    except asyncio.TimeoutError:
+        pass
+    print("✅ Rooms stay isolated")
+    
+    for ws in (alice, bob, carol):
+        await ws.close()
+    return True
+
+def test_sharded_workers():
+    """Test the multi-worker WebSocket server on this machine"""
+    print("\n🧪 Testing Sharded WebSocket Workers...")
+    
+    try:
+        import asyncio
+        import websockets  # noqa: F401
+        from sharding import ShardMap
+    except ImportError as e:
+        print(f"❌ Import error: {e}")
+        return False
+    
+    workers = 3
+    port = 18765
+    base_port = 18766
+    worker_urls = [f"ws://localhost:{base_port + index}" for index in range(workers)]
+    shard_map = ShardMap(worker_urls, 0)
+    
+    # Consistent hashing spreads rooms evenly
+    counts = shard_map.distribution([f"R{i:06d}" for i in range(6000)])
+    expected = 6000 / workers
+    if any(abs(count - expected) > expected * 0.2 for count in counts.values()):
+        print(f"❌ Unbalanced room distribution: {counts}")
+        return False
+    print(f"✅ Balanced room distribution: {sorted(counts.values())}")
+    
+    # The workers snapshot their rooms when terminated; keep that out of the working tree
+    snapshot_dir = tempfile.TemporaryDirectory()
+    env = dict(
+        os.environ,
+        WEBSOCKET_WORKERS=str(workers),
+        WEBSOCKET_HOST="localhost",
+        WEBSOCKET_PORT=str(port),
+        WEBSOCKET_WORKER_BASE_PORT=str(base_port),
+        ROOM_SNAPSHOT_PATH=os.path.join(snapshot_dir.name, "room_snapshot.jsonl")
+    )
+    server = subprocess.Popen([sys.executable, "websocket_server.py"], env=env)
+    try:
+        time.sleep(3)  # let the workers bind
+        if not asyncio.run(_check_sharded_rooms(f"ws://localhost:{port}", shard_map)):
+            return False
+        print("🎉 Sharded worker tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Sharded worker test error: {e}")
+        return False
+    finally:
+        server.terminate()
+        server.wait(timeout=20)
+        snapshot_dir.cleanup()
+
+async def _check_backplane_nodes():
+    """Run two servers joined by an in-process backplane and share one room between them"""
+    import asyncio
+    import websockets
+    from backplane import InProcessBackplane, InProcessBus
+    from websocket_server import WatchRoomServer, serve_websocket
+    
+    async def wait_for(ws, msg_type):
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), 2))
+            if message["type"] == msg_type:
+                return message
+    
+    bus = InProcessBus()
+    nodes = [WatchRoomServer(backplane=InProcessBackplane(bus)) for _ in range(2)]
+    for node in nodes:
+        await node.start()
+    
+    async with serve_websocket(nodes[0], "localhost", 18801), serve_websocket(nodes[1], "localhost", 18802):
+        alice = await websockets.connect("ws://localhost:18801")
+        await alice.send(json.dumps({"room_code": "PLANE001", "user_id": "alice", "username": "alice"}))
+        await wait_for(alice, "room_state")
+        await alice.send(json.dumps({"type": "playback_update", "playback_state": {"playing": True, "current_time": 30}}))
+        
+        # A member joining through the other node sees the same presence, host and playback
+        bob = await websockets.connect("ws://localhost:18802")
+        await bob.send(json.dumps({"room_code": "PLANE001", "user_id": "bob", "username": "bob"}))
+        room = (await wait_for(bob, "room_state"))["room"]
+        if room["user_count"] != 2 or room["host_id"] != "alice" or not room["playback_state"]["playing"]:
+            print(f"❌ Room state not shared across nodes: {room}")
+            return False
+        await wait_for(alice, "user_joined")
+        print("✅ Presence, host and playback shared across nodes")
+        
+        await bob.send(json.dumps({"type": "chat_message", "user_id": "bob", "username": "bob", "message": "hi"}))
+        if (await wait_for(alice, "chat_message"))["message"]["message"] != "hi":
+            print("❌ Chat not relayed between nodes")
+            return False
+        print("✅ Broadcasts reach members on other nodes")
+        
+        # The host role moves across nodes when the host leaves
+        await alice.close()
+        if (await wait_for(bob, "user_left"))["host_id"] != "bob":
+            print("❌ Host not handed over across nodes")
+            return False
+        print("✅ Host handed over across nodes")
+        await bob.close()
+    return True
+
+def test_backplane():
+    """Test room sharing between WebSocket servers over the backplane"""
+    print("\n🧪 Testing WebSocket Backplane...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_backplane_nodes()):
+            return False
+        print("🎉 Backplane tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Backplane test error: {e}")
+        return False
+
+async def _check_session_resume():
+    """Drop and resume sessions on an in-process server: replay, snapshot fallback, leaving and grace expiry"""
+    import asyncio
+    from collections import deque
+    import websockets
+    from websocket_server import WatchRoomServer, serve_websocket
+    
+    async def wait_for(ws, msg_type, timeout=2):
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+            if message["type"] == msg_type:
+                return message
+    
+    async def join(user_id, **resume):
+        ws = await websockets.connect("ws://localhost:18803")
+        await ws.send(json.dumps({"room_code": "RESUME01", "user_id": user_id, "username": user_id, **resume}))
+        return ws
+    
+    async def chat(ws, text):
+        await ws.send(json.dumps({"type": "chat_message", "user_id": "alice", "username": "alice", "message": text}))
+    
+    server = WatchRoomServer()
+    server.resume_grace = 1
+    await server.start()
+    async with serve_websocket(server, "localhost", 18803):
+        alice = await join("alice")
+        await wait_for(alice, "room_state")
+        bob = await join("bob")
+        state = await wait_for(bob, "room_state")
+        token, seq = state["resume_token"], state["seq"]
+        await wait_for(alice, "user_joined")
+        
+        # An abnormal drop keeps the seat, and a resume replays only the events missed
+        bob.transport.abort()
+        await asyncio.sleep(0.2)
+        await chat(alice, "one")
+        await chat(alice, "two")
+        await wait_for(alice, "chat_message")
+        await wait_for(alice, "chat_message")
+        bob = await join("bob", resume_token=token, last_seq=seq)
+        resumed = await wait_for(bob, "resumed")
+        replayed = [(await wait_for(bob, "chat_message"))["message"]["message"] for _ in range(2)]
+        if resumed["replayed"] != 2 or replayed != ["one", "two"]:
+            print(f"❌ Missed events not replayed: {resumed}, {replayed}")
+            return False
+        print("✅ Resume replays the missed events")
+        
+        # A gap older than the replay ring falls back to a full room_state
+        token, seq = resumed["resume_token"], resumed["seq"]
+        bob.transport.abort()
+        await asyncio.sleep(0.2)
+        room = server.rooms["RESUME01"]
+        room.replay = deque(room.replay, maxlen=1)
+        await chat(alice, "three")
+        await chat(alice, "four")
+        bob = await join("bob", resume_token=token, last_seq=seq)
+        state = await wait_for(bob, "room_state")
+        if not state.get("resumed") or state["room"]["user_count"] != 2:
+            print(f"❌ No snapshot fallback for a gap out of the ring: {state}")
+            return False
+        print("✅ Resume falls back to a snapshot when the gap is out of the ring")
+        
+        # A tab closing (1001) leaves at once
+        await bob.close(1001)
+        try:
+            await wait_for(alice, "user_left", 0.5)
+        except asyncio.TimeoutError:
+            print("❌ A client-sent 1001 close kept the seat")
+            return False
+        print("✅ A client-sent 1001 close leaves the room")
+        
+        # A seat nobody resumes is given up after the grace period
+        carol = await join("carol")
+        await wait_for(carol, "room_state")
+        await wait_for(alice, "user_joined")
+        carol.transport.abort()
+        await wait_for(alice, "user_left", server.resume_grace + 2)
+        if server.session_counters["expired"] != 1:
+            print(f"❌ Suspended session not expired: {server.session_counters}")
+            return False
+        print("✅ Unresumed sessions expire after the grace period")
+        await alice.close()
+    await server.close()
+    return True
+
+def test_session_resume():
+    """Test resuming dropped WebSocket sessions"""
+    print("\n🧪 Testing WebSocket Session Resume...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_session_resume()):
+            return False
+        print("🎉 Session resume tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Session resume test error: {e}")
+        return False
+
+async def _check_drain_restore():
+    """Drain an in-process server to a snapshot and restore its rooms on a second one"""
+    import asyncio
+    import websockets
+    from websocket_server import RESTART_CLOSE_CODE, WatchRoomServer, serve_websocket
+    
+    async def wait_for(ws, msg_type, timeout=2):
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+            if message["type"] == msg_type:
+                return message
+    
+    async def join(port, room_code, user_id):
+        ws = await websockets.connect(f"ws://localhost:{port}")
+        await ws.send(json.dumps({"room_code": room_code, "user_id": user_id, "username": user_id}))
+        await wait_for(ws, "room_state")
+        return ws
+    
+    snapshot_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(snapshot_dir.name, "rooms.jsonl")
+    old = WatchRoomServer()
+    await old.start()
+    async with serve_websocket(old, "localhost", 18804):
+        alice = await join(18804, "DRAIN001", "alice")
+        bob = await join(18804, "DRAIN001", "bob")
+        carol = await join(18804, "GONE0001", "carol")
+        dave = await join(18804, "IDLE0001", "dave")
+        await alice.send(json.dumps({"type": "playback_update", "playback_state": {"playing": True, "current_time": 40}}))
+        await alice.send(json.dumps({"type": "chat_message", "user_id": "alice", "username": "alice", "message": "hello"}))
+        await wait_for(bob, "chat_message")
+        seq = old.rooms["DRAIN001"].seq
+        
+        # The first room's snapshot step waits, and the second room empties meanwhile
+        old.rooms["DRAIN001"].actor.tell(asyncio.sleep, 0.2)
+        drain = asyncio.create_task(old.drain(path, timeout=2))
+        await asyncio.sleep(0.05)
+        await carol.close()
+        await asyncio.wait_for(drain, 5)
+        with open(path, encoding="utf-8") as snapshot:
+            saved = sorted(json.loads(line)["room_code"] for line in snapshot)
+        if saved != ["DRAIN001", "IDLE0001"] or os.path.exists(path + ".tmp"):
+            print(f"❌ Snapshot has {saved}, or its partial file was left behind")
+            return False
+        await bob.wait_closed()
+        if bob.close_code != RESTART_CLOSE_CODE:
+            print(f"❌ Drained clients closed with {bob.close_code}")
+            return False
+        print("✅ Drain snapshots the live rooms, skips the dropped one and closes clients with 1012")
+        for ws in (alice, dave):
+            await ws.close()
+    await old.close()
+    
+    new = WatchRoomServer()
+    new.restore_grace = 0.5
+    await new.start()
+    try:
+        if new.restore_rooms(path) != 2 or os.path.exists(path):
+            print("❌ Snapshot not restored once and deleted")
+            return False
+        async with serve_websocket(new, "localhost", 18805):
+            bob = await websockets.connect("ws://localhost:18805")
+            await bob.send(json.dumps({"room_code": "DRAIN001", "user_id": "bob", "username": "bob"}))
+            state = await wait_for(bob, "room_state")
+            room = state["room"]
+            playback = room["playback_state"]
+            if (room["host_id"] != "alice" or state["seq"] <= seq or [m["message"] for m in room["chat_messages"]] != ["hello"]
+                    or not playback["playing"] or not 40 <= playback["current_time"] < 45):
+                print(f"❌ Restored room differs: {state}")
+                return False
+            print("✅ Host, seq, chat and playback survive the restart")
+            
+            # Alice never comes back, and nobody rejoins the idle room
+            await asyncio.sleep(new.restore_grace + 0.5)
+            if new.rooms["DRAIN001"].host_id != "bob" or "IDLE0001" in new.rooms:
+                print(f"❌ Grace expiry left host {new.rooms['DRAIN001'].host_id}, rooms {list(new.rooms)}")
+                return False
+            print("✅ After the grace period the host role moves on and unclaimed rooms are dropped")
+            await bob.close()
+    finally:
+        await new.close()
+        snapshot_dir.cleanup()
+    return True
+
+def test_drain_restore():
+    """Test the SIGTERM drain snapshot and its restore on the next process"""
+    print("\n🧪 Testing Drain and Restore...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_drain_restore()):
+            return False
+        print("🎉 Drain and restore tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Drain and restore test error: {e}")
+        return False
+
+async def _check_heartbeat_reaper():
+    """Stop one client answering pings and check it is reaped while a live one stays"""
+    import asyncio
+    import websockets
+    from websocket_server import WatchRoomServer, serve_websocket
+    
+    server = WatchRoomServer()
+    server.ping_interval = server.ping_timeout = 0.5
+    await server.start()
+    async with serve_websocket(server, "localhost", 18806):
+        clients = {}
+        for room_code in ("BEAT0001", "BEAT0002"):
+            ws = clients[room_code] = await websockets.connect("ws://localhost:18806")
+            await ws.send(json.dumps({"room_code": room_code, "user_id": room_code, "username": room_code}))
+            await asyncio.wait_for(ws.recv(), 2)
+        
+        # A half-open socket: the client neither reads the ping nor answers it
+        clients["BEAT0001"].transport.pause_reading()
+        for _ in range(40):
+            if "BEAT0001" not in server.rooms:
+                break
+            await asyncio.sleep(0.1)
+        stats = server.get_reaper_stats()
+        if "BEAT0001" in server.rooms or stats["reaped"] != 1 or stats["rooms_freed"] != 1:
+            print(f"❌ Silent connection not reaped: {stats}, rooms {list(server.rooms)}")
+            return False
+        if "BEAT0002" not in server.rooms or stats["pings_sent"] < 2:
+            print(f"❌ Live connection reaped or never pinged: {stats}")
+            return False
+        print("✅ A connection that stops answering pings is reaped and its room freed")
+        clients["BEAT0001"].transport.abort()
+        await clients["BEAT0002"].close()
+    await server.close()
+    return True
+
+def test_heartbeat_reaper():
+    """Test reaping WebSocket connections that stop answering pings"""
+    print("\n🧪 Testing Heartbeat Reaper...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_heartbeat_reaper()):
+            return False
+        print("🎉 Heartbeat reaper tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Heartbeat reaper test error: {e}")
+        return False
+
+async def _check_rate_limits():
+    """Send one chat over the burst allowance and check only chat is refused"""
+    import asyncio
+    import websockets
+    from config import MESSAGE_RATE_LIMITS
+    from websocket_server import WatchRoomServer, serve_websocket
+    
+    async def wait_for(ws, msg_type):
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), 2))
+            if message["type"] == msg_type:
+                return message
+    
+    burst, per_minute = MESSAGE_RATE_LIMITS["chat_message"]
+    server = WatchRoomServer()
+    await server.start()
+    async with serve_websocket(server, "localhost", 18807):
+        ws = await websockets.connect("ws://localhost:18807")
+        await ws.send(json.dumps({"room_code": "LIMIT001", "user_id": "alice", "username": "alice"}))
+        await wait_for(ws, "room_state")
+        
+        for index in range(burst + 1):
+            await ws.send(json.dumps({"type": "chat_message", "user_id": "alice", "username": "alice", "message": str(index)}))
+        for _ in range(burst):
+            await wait_for(ws, "chat_message")
+        throttled = await wait_for(ws, "throttled")
+        # One token comes back every 60 / per_minute seconds
+        if throttled["message_type"] != "chat_message" or not 0 < throttled["retry_after_ms"] <= 60000 / per_minute:
+            print(f"❌ Chat over the limit not throttled sanely: {throttled}")
+            return False
+        if len(server.rooms["LIMIT001"].chat) != burst:
+            print("❌ A throttled chat message was stored")
+            return False
+        print(f"✅ Chat message {burst + 1} is throttled, retry after {throttled['retry_after_ms']} ms")
+        
+        await ws.send(json.dumps({"type": "sync_request"}))
+        if "current_time" not in (await wait_for(ws, "playback_update"))["playback_state"]:
+            print("❌ sync_request not answered after chat was throttled")
+            return False
+        print("✅ Other message types still pass")
+        await ws.close()
+    await server.close()
+    return True
+
+def test_rate_limits():
+    """Test per-type token bucket limits on WebSocket messages"""
+    print("\n🧪 Testing Message Rate Limits...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_rate_limits()):
+            return False
+        print("🎉 Rate limit tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Rate limit test error: {e}")
+        return False
+
+def test_chat_queries():
+    """Test polling and paging the backend chat log by message id, timestamp and cursor"""
+    print("\n🧪 Testing Chat Queries...")
+    
+    try:
+        from fastapi.testclient import TestClient
+        from backend.app.main import app
+    except ImportError as e:
+        print(f"❌ Import error: {e}")
+        return False
+    
+    try:
+        with TestClient(app) as client:
+            client.post("/api/rooms", json={"room_code": "CHATQ001", "host_id": "alice", "room_name": "Chat",
+                                            "room_type": "watch"})
+            sent = [
+                client.post("/api/chat/messages", json={"room_code": "CHATQ001", "user_id": "alice",
+                                                        "username": "alice", "message": str(i)}).json()
+                for i in range(10)
+            ]
+            
+            def texts(**params):
+                return [m["message"] for m in client.get("/api/chat/CHATQ001/messages", params=params).json()]
+            
+            digits = [str(i) for i in range(10)]
+            checks = [
+                ("all messages", texts(), digits),
+                ("newest page", texts(limit=3), ["7", "8", "9"]),
+                ("after_id", texts(after_id=sent[6]["id"]), ["7", "8", "9"]),
+                ("after_id with limit", texts(after_id=sent[2]["id"], limit=2), ["3", "4"]),
+                ("after the newest", texts(after_id=sent[9]["id"]), []),
+                ("unknown after_id resyncs", texts(after_id="missing", limit=2), ["8", "9"]),
+                ("since before the first", texts(since=sent[0]["timestamp"] - 1), digits),
+                ("since the last", texts(since=sent[9]["timestamp"]), []),
+                ("before a cursor", texts(before=sent[5]["cursor"], limit=2), ["3", "4"]),
+                ("before the first", texts(before=sent[0]["cursor"]), []),
+                ("before past the end", texts(before=sent[9]["cursor"] + 5, limit=1), ["9"])
+            ]
+            for name, got, expected in checks:
+                if got != expected:
+                    print(f"❌ Chat query {name}: got {got}, expected {expected}")
+                    return False
+            print(f"✅ {len(checks)} chat queries return the right messages")
+            
+            if client.get("/api/chat/CHATQ001/messages", params={"limit": 0}).status_code != 422:
+                print("❌ A zero limit was accepted")
+                return False
+            print("✅ Invalid limits are rejected")
+        print("🎉 Chat query tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Chat query test error: {e}")
+        return False
+
+def test_backend_fanout():
+    """Test the backend WebSocket fan-out of room events and private messages"""
+    print("\n🧪 Testing Backend Fan-out...")
+    
+    try:
+        from fastapi.testclient import TestClient
+        from backend.app.main import app
+    except ImportError as e:
+        print(f"❌ Import error: {e}")
+        return False
+    
+    try:
+        with TestClient(app) as client:
+            client.post("/api/rooms", json={"room_code": "FAN00001", "host_id": "alice", "room_name": "Fan",
+                                            "room_type": "watch"})
+            with client.websocket_connect("/ws/FAN00001?user_id=alice") as alice, \
+                    client.websocket_connect("/ws/FAN00001?user_id=bob") as bob, \
+                    client.websocket_connect("/ws/FAN00001?user_id=carol") as carol:
+                # A REST mutation and a socket message both reach every socket in the room
+                client.post("/api/chat/messages", json={"room_code": "FAN00001", "user_id": "alice",
+                                                        "username": "alice", "message": "rest"})
+                alice.send_json({"type": "notes_update", "data": {"notes": "socket"}})
+                for ws in (alice, bob, carol):
+                    received = [ws.receive_json() for _ in range(2)]
+                    if [(m["type"], m["data"].get("message") or m["data"].get("notes")) for m in received] != \
+                            [("chat_message", "rest"), ("notes_update", "socket")]:
+                        print(f"❌ Room events not fanned out: {received}")
+                        return False
+                print("✅ REST and socket events reach every socket in the room")
+                
+                # A private message reaches the receiver and the sender only; carol's next event is the chat after it
+                alice.send_json({"type": "private_message", "data": {"receiver_id": "bob", "message": "psst"}})
+                client.post("/api/chat/messages", json={"room_code": "FAN00001", "user_id": "alice",
+                                                        "username": "alice", "message": "after"})
+                for name, ws, expected in (("alice", alice, "private_message"), ("bob", bob, "private_message"),
+                                           ("carol", carol, "chat_message")):
+                    if ws.receive_json()["type"] != expected:
+                        print(f"❌ {name} got the wrong event for a private message")
+                        return False
+                print("✅ Private messages reach only the receiver and the sender")
+        print("🎉 Backend fan-out tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Backend fan-out test error: {e}")
+        return False
+
+async def _check_long_poll():
+    """Long-poll a room across a publish, then from a cursor that fell out of the feed"""
+    import asyncio
+    import time
+    import httpx
+    from config import CHANGE_FEED_SIZE
+    from backend.app.main import app
+    
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/api/rooms", json={"room_code": "POLL0001", "host_id": "alice", "room_name": "Poll",
+                                              "room_type": "watch"})
+        cursor = (await client.get("/api/rooms/POLL0001/changes")).json()["cursor"]
+        
+        started = time.perf_counter()
+        poll = asyncio.create_task(client.get("/api/rooms/POLL0001/changes", params={"cursor": cursor, "timeout": 5}))
+        await asyncio.sleep(0.2)
+        await client.post("/api/chat/messages", json={"room_code": "POLL0001", "user_id": "alice",
+                                                      "username": "alice", "message": "wake"})
+        changes = (await poll).json()
+        waited = time.perf_counter() - started
+        if [event["type"] for event in changes["events"]] != ["chat_message"] or changes["reset"] or waited > 2:
+            print(f"❌ Long poll not woken by a publish: {changes} after {waited:.2f}s")
+            return False
+        print(f"✅ Long poll returns on publish after {waited:.2f}s")
+        
+        # Push the poll's cursor out of the feed
+        for index in range(CHANGE_FEED_SIZE + 1):
+            await client.post("/api/meeting/notes", json={"room_code": "POLL0001", "notes": str(index),
+                                                          "user_id": "alice"})
+        changes = (await client.get("/api/rooms/POLL0001/changes",
+                                    params={"cursor": changes["cursor"], "timeout": 5})).json()
+        latest = (await client.get("/api/rooms/POLL0001/changes")).json()["cursor"]
+        if not changes["reset"] or changes["events"] or changes["cursor"] != latest:
+            print(f"❌ Stale cursor not reset: {changes}")
+            return False
+        print("✅ A cursor that fell out of the feed gets reset to the current one")
+    return True
+
+def test_backend_long_poll():
+    """Test the backend long poll for room changes"""
+    print("\n🧪 Testing Backend Long Poll...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_long_poll()):
+            return False
+        print("🎉 Backend long poll tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Backend long poll test error: {e}")
+        return False
+
+async def _check_event_stream():
+    """Resume a room's event stream through Last-Event-ID, then from an id that fell out of the feed"""
+    import asyncio
+    import httpx
+    from config import CHANGE_FEED_SIZE
+    from backend.app.main import app
+    
+    async def read_events(last_event_id, count):
+        """Open the stream with a Last-Event-ID and read count messages after the retry hint"""
+        # Driven as a raw ASGI call, since test clients buffer a streaming response until it ends
+        chunks, done = [], asyncio.Event()
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                 "scheme": "http", "path": "/api/rooms/SSE00001/events", "raw_path": b"/api/rooms/SSE00001/events",
+                 "query_string": b"", "root_path": "", "headers": [(b"last-event-id", str(last_event_id).encode())],
+                 "server": ("test", 80), "client": ("test", 1)}
+        
+        async def receive():
+            await done.wait()
+            return {"type": "http.disconnect"}
+        
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                chunks.append(message["body"].decode())
+                if "".join(chunks).count("\n\n") > count:
+                    done.set()
+        
+        stream = asyncio.create_task(app(scope, receive, send))
+        await asyncio.wait_for(done.wait(), 5)
+        await asyncio.wait_for(stream, 2)
+        messages = "".join(chunks).split("\n\n")[1:count + 1]
+        return [dict(line.split(": ", 1) for line in message.split("\n")) for message in messages]
+    
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/api/rooms", json={"room_code": "SSE00001", "host_id": "alice", "room_name": "SSE",
+                                              "room_type": "watch"})
+        cursor = (await client.get("/api/rooms/SSE00001/changes")).json()["cursor"]
+        await client.post("/api/chat/messages", json={"room_code": "SSE00001", "user_id": "alice",
+                                                      "username": "alice", "message": "seen"})
+        await client.post("/api/chat/messages", json={"room_code": "SSE00001", "user_id": "alice",
+                                                      "username": "alice", "message": "missed"})
+        
+        events = await read_events(cursor + 1, 1)
+        if events[0]["id"] != str(cursor + 2) or json.loads(events[0]["data"])["data"]["message"] != "missed":
+            print(f"❌ Last-Event-ID resume did not start after that event: {events}")
+            return False
+        print("✅ Last-Event-ID resumes with the first missed event")
+        
+        # Push the resumed id out of the feed
+        for index in range(CHANGE_FEED_SIZE + 1):
+            await client.post("/api/meeting/notes", json={"room_code": "SSE00001", "notes": str(index),
+                                                          "user_id": "alice"})
+        latest = (await client.get("/api/rooms/SSE00001/changes")).json()["cursor"]
+        events = await read_events(cursor + 2, 1)
+        if events[0]["event"] != "reset" or events[0]["id"] != str(latest):
+            print(f"❌ Stale Last-Event-ID not reset: {events}")
+            return False
+        print("✅ An id that fell out of the feed gets a reset event")
+    return True
+
+def test_backend_event_stream():
+    """Test the backend Server-Sent Events stream of room changes"""
+    print("\n🧪 Testing Backend Event Stream...")
+    
+    try:
+        import asyncio
+        if not asyncio.run(_check_event_stream()):
+            return False
+        print("🎉 Backend event stream tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Backend event stream test error: {e}")
+        return False
+
+def test_backend_retention():
+    """Test the backend's chat cap, least-recently-active room eviction and idle sweep"""
+    print("\n🧪 Testing Backend Retention...")
+    
+    try:
+        from fastapi.testclient import TestClient
+        from backend.app import main
+        from config import MAX_CHAT_MESSAGES_PER_ROOM
+    except ImportError as e:
+        print(f"❌ Import error: {e}")
+        return False
+    
+    retention = main.room_retention
+    max_entries, ttl = retention.max_entries, retention.ttl
+    evicted = dict(retention.counters)
+    try:
+        with TestClient(main.app) as client:
+            for room_code in list(main.rooms_db):
+                retention.forget(room_code)
+                main.evict_room(room_code)
+            
+            def create(room_code):
+                client.post("/api/rooms", json={"room_code": room_code, "host_id": "alice", "room_name": room_code,
+                                                "room_type": "watch"})
+            
+            create("KEEP0001")
+            for index in range(MAX_CHAT_MESSAGES_PER_ROOM + 5):
+                client.post("/api/chat/messages", json={"room_code": "KEEP0001", "user_id": "alice",
+                                                        "username": "alice", "message": str(index)})
+            messages = client.get("/api/chat/KEEP0001/messages").json()
+            if len(messages) != MAX_CHAT_MESSAGES_PER_ROOM or messages[0]["message"] != "5":
+                print(f"❌ Chat not capped at {MAX_CHAT_MESSAGES_PER_ROOM}: {len(messages)} kept")
+                return False
+            print("✅ Room chat is capped, oldest first")
+            
+            # Past the cap the least recently active room goes, unless a socket holds it
+            retention.max_entries = 3
+            create("BUSY0001")
+            create("IDLE0001")
+            client.get("/api/rooms/KEEP0001")
+            with client.websocket_connect("/ws/BUSY0001"):
+                create("NEW00001")
+                if sorted(main.rooms_db) != ["BUSY0001", "KEEP0001", "NEW00001"]:
+                    print(f"❌ Wrong rooms evicted over the cap: {sorted(main.rooms_db)}")
+                    return False
+                if "IDLE0001" in main.chat_messages or client.get("/api/rooms/IDLE0001").status_code != 404:
+                    print("❌ An evicted room left data behind")
+                    return False
+                print("✅ The least recently active room is evicted over the cap, rooms in use are kept")
+                
+                # Every room is idle with a zero TTL, but the one in use
+                retention.ttl = 0
+                client.portal.call(main.sweeper.sweep)
+                if list(main.rooms_db) != ["BUSY0001"]:
+                    print(f"❌ Idle sweep kept {sorted(main.rooms_db)}")
+                    return False
+            client.portal.call(main.sweeper.sweep)
+            if main.rooms_db or main.manager.feeds:
+                print(f"❌ Idle sweep left {list(main.rooms_db)}, feeds {list(main.manager.feeds)}")
+                return False
+            print("✅ The sweep evicts idle rooms once nothing holds them")
+            
+            stats = client.get("/api/admin/memory").json()["retention"]["rooms"]
+            if (stats["evicted_lru"] - evicted["evicted_lru"], stats["expired"] - evicted["expired"]) != (1, 3):
+                print(f"❌ Eviction counts off: {stats}")
+                return False
+            print("✅ Evictions are reported by /api/admin/memory")
+        print("🎉 Backend retention tests passed!")
+        return True
+    except Exception as e:
+        print(f"❌ Backend retention test error: {e}")
+        return False
+    finally:
+        retention.max_entries, retention.ttl = max_entries, ttl
+
 def test_file_structure():
     """Test if all required files exist"""
     print("\n🧪 Testing File Structure...")
@@ -180,6 +970,17 @@ def main():
         test_file_structure,
         test_dependencies,
         test_frontend,
+        test_sharded_workers,
+        test_backplane,
+        test_session_resume,
+        test_drain_restore,
+        test_heartbeat_reaper,
+        test_rate_limits,
+        test_chat_queries,
+        test_backend_fanout,
+        test_backend_long_poll,
+        test_backend_event_stream,
+        test_backend_retention,
         test_backend
     ]
     
@@ -0,0 +1,106 @@
+"""
+PartyWatch Timing Wheel
+Hashed timing wheel sharing one event-loop timer among many connection timeouts
+"""
+
+import asyncio
+import math
+from typing import Callable, List, Optional, Set
+
+from config import TIMER_WHEEL_TICK_MS, TIMER_WHEEL_SLOTS
+
+class WheelTimer:
+    """Handle for a callback scheduled on a TimingWheel"""
+    
+    __slots__ = ('wheel', 'deadline', 'callback', 'args', 'cancelled')
+    
+    def __init__(self, wheel: 'TimingWheel', deadline: int, callback: Callable, args: tuple):
+        self.wheel = wheel
+        self.deadline = deadline  # tick on which the callback runs
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        """Unschedule the callback, a no-op once it has run"""
+        if not self.cancelled:
+            self.cancelled = True
+            self.wheel._discard(self)
+
+class TimingWheel:
+    """Timers bucketed by deadline tick, so scheduling and cancelling are O(1)
+    
+    Only one loop timer is armed however many timers are pending, and none
+    while the wheel is empty. Timers fire on tick boundaries, never early
+    and at most one tick late.
+    """
+    
+    def __init__(self, tick: float = TIMER_WHEEL_TICK_MS / 1000, slots: int = TIMER_WHEEL_SLOTS):
+        self.tick = tick
+        self._slots: List[Set[WheelTimer]] = [set() for _ in range(slots)]
+        self._tick = 0  # next tick to process
+        self._next_at = 0.0  # loop time of that tick
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._count = 0
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def schedule(self, delay: float, callback: Callable, *args) -> WheelTimer:
+        """Run callback(*args) after at least delay seconds"""
+        loop = asyncio.get_running_loop()
+        if self._handle is None:
+            self._next_at = loop.time() + self.tick
+            self._handle = loop.call_at(self._next_at, self._advance)
+        
+        # The next tick may be less than a full tick away, so round up from there
+        ticks = max(0, math.ceil((delay - (self._next_at - loop.time())) / self.tick))
+        timer = WheelTimer(self, self._tick + ticks, callback, args)
+        self._slots[timer.deadline % len(self._slots)].add(timer)
+        self._count += 1
+        return timer
+    
+    def _discard(self, timer: WheelTimer):
+        """Remove a cancelled timer from its slot"""
+        slot = self._slots[timer.deadline % len(self._slots)]
+        if timer in slot:
+            slot.remove(timer)
+            self._count -= 1
+    
+    def _advance(self):
+        """Run the timers due on this tick, then arm the next tick if any remain"""
+        slot = self._slots[self._tick % len(self._slots)]
+        # Timers a whole revolution or more away share the slot and stay put
+        due = [timer for timer in slot if timer.deadline <= self._tick]
+        self._tick += 1
+        self._next_at += self.tick
+        for timer in due:
+            slot.discard(timer)
+            self._count -= 1
+        
+        for timer in due:
+            if timer.cancelled:
+                # Cancelled by an earlier callback on this tick
+                continue
+            timer.cancelled = True  # cancel() after firing is a no-op
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"Error in timer callback: {e}")
+        
+        if self._count:
+            # A late tick catches up by running the next ones straight away
+            self._handle = asyncio.get_running_loop().call_at(self._next_at, self._advance)
+        else:
+            self._handle = None
+    
+    def stop(self):
+        """Drop every pending timer"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for slot in self._slots:
+            for timer in slot:
+                timer.cancelled = True
+            slot.clear()
+        self._count = 0
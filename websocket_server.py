@@ -1,148 +1,1182 @@
 import asyncio
+import contextlib
+import math
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
 import websockets
-import json
-import uuid
-from datetime import datetime
-from typing import Dict, Set, List
+import secrets
+from collections import deque
+from typing import Dict, Set, List, Optional, Tuple, Union
+
+from backplane import Backplane, create_backplane
+from frame_compression import deflate_extensions, frame_cache, shared_frame
+from metrics import Counter, Gauge, ServerMetrics, serve_metrics
+from rate_limit import RateLimiter
+from records import ChatMessage, Member, Room, new_id
+from room_actor import RoomActor
+from playback import ClockEstimate, client_number, server_time, to_wire_time
+from sharding import ShardMap
+from timing_wheel import TimingWheel, WheelTimer
+from wire_format import JSON_CODEC, SUBPROTOCOLS, DecodeError, Frame, get_codec
+from config import (
+    WEBSOCKET_HOST,
+    WEBSOCKET_PORT,
+    WEBSOCKET_PUBLIC_HOST,
+    WEBSOCKET_WORKERS,
+    WEBSOCKET_WORKER_BASE_PORT,
+    JOIN_SNAPSHOT_CHAT_MESSAGES,
+    CHAT_HISTORY_PAGE_SIZE,
+    WEBSOCKET_COMPRESSION,
+    WEBSOCKET_PING_INTERVAL,
+    WEBSOCKET_PING_TIMEOUT,
+    WEBSOCKET_MAX_MESSAGE_SIZE,
+    PLAYBACK_COALESCE_WINDOW_MS,
+    SCHEDULED_SYNC_MARGIN_MS,
+    SCHEDULED_SYNC_MIN_LEAD_MS,
+    SCHEDULED_SYNC_MAX_LEAD_MS,
+    RESUME_GRACE_SECONDS,
+    OUTBOUND_QUEUE_HIGH_WATER,
+    OUTBOUND_QUEUE_DEFAULT_POLICY,
+    OUTBOUND_QUEUE_POLICIES,
+    WEBSOCKET_BACKPLANE,
+    BACKPLANE_STATE_TIMEOUT_MS,
+    METRICS_HOST,
+    METRICS_PORT,
+    ROOM_SNAPSHOT_PATH,
+    ROOM_RESTORE_GRACE_SECONDS,
+    DRAIN_TIMEOUT_SECONDS
+)
+
+# Outbound queue policies
+POLICY_FIFO = 'fifo'      # keep every frame, disconnect the client past the high-water mark
+POLICY_LATEST = 'latest'  # coalesce into the single newest pending frame
+POLICY_DROP = 'drop'      # discard new frames past the high-water mark
+
+SCHEDULABLE_ACTIONS = ('play', 'pause', 'seek')
+
+# Message types clients send; anything else is counted as 'other' so metric labels stay bounded
+CLIENT_MESSAGE_TYPES = frozenset(('playback_update', 'sync_request', 'fetch_history', 'clock_ping', 'chat_message', 'user_action'))
+
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try Again Later"
+NORMAL_CLOSE_CODE = 1000  # a client closing this way has left for good
+LEAVE_CLOSE_CODES = (NORMAL_CLOSE_CODE, 1001)  # client-sent codes that give up the seat; 1001 is a closed or navigated tab
+HEARTBEAT_CLOSE_CODE = 1001  # "Going Away", sent to a client reaped for not answering pings
+RESTART_CLOSE_CODE = 1012  # "Service Restart", sent to every client when the server drains
+REDIRECT_CLOSE_CODE = 4302  # room lives on another worker, see the preceding redirect frame
+
+REMOTE_ORIGIN = ''  # exclude_client for events relayed from other nodes: no local client sent them
+
+# Every worker can share the public port where the kernel supports it, otherwise worker 0 fronts it
+SHARED_FRONT_PORT = hasattr(socket, 'SO_REUSEPORT')
+
+class OutboundQueue:
+    """Bounded per-connection frame queue with a delivery policy per message type"""
+    
+    def __init__(self, high_water: int = OUTBOUND_QUEUE_HIGH_WATER,
+                 policies: Dict[str, str] = None, default_policy: str = OUTBOUND_QUEUE_DEFAULT_POLICY,
+                 counters: Dict[str, int] = None):
+        self.high_water = high_water
+        self.policies = OUTBOUND_QUEUE_POLICIES if policies is None else policies
+        self.default_policy = default_policy
+        self.counters = counters if counters is not None else {'dropped': 0, 'coalesced': 0, 'evicted': 0}
+        self.dropped = 0
+        self.coalesced = 0
+        self._frames: deque = deque()  # [msg_type, frame, shared] entries in send order
+        self._latest: Dict[str, List] = {}  # msg_type -> pending latest-wins entry
+        self._ready = asyncio.Event()
+    
+    def __len__(self) -> int:
+        return len(self._frames)
+    
+    def put(self, msg_type: str, frame: Union[str, bytes], shared: bool = False) -> bool:
+        """Queue a frame, returning False when the client has overflowed and must be evicted
+        
+        shared marks a frame that other sockets are sent too, so its compressed form is worth caching.
+        """
+        policy = self.policies.get(msg_type, self.default_policy)
+        
+        if policy == POLICY_LATEST:
+            entry = self._latest.get(msg_type)
+            if entry is not None:
+                # Replace the pending frame in place, it keeps its queue position
+                entry[1] = frame
+                entry[2] = shared
+                self.coalesced += 1
+                self.counters['coalesced'] += 1
+                return True
+            entry = [msg_type, frame, shared]
+            self._latest[msg_type] = entry
+            self._frames.append(entry)
+        elif len(self._frames) >= self.high_water:
+            if policy == POLICY_DROP:
+                self.dropped += 1
+                self.counters['dropped'] += 1
+                return True
+            return False
+        else:
+            self._frames.append([msg_type, frame, shared])
+        
+        self._ready.set()
+        return True
+    
+    def clear(self):
+        """Discard every pending frame"""
+        self._frames.clear()
+        self._latest.clear()
+    
+    async def get(self) -> Tuple[Union[str, bytes], bool]:
+        """Wait for the next frame to write, with whether it is shared"""
+        while not self._frames:
+            self._ready.clear()
+            await self._ready.wait()
+        
+        entry = self._frames.popleft()
+        if self._latest.get(entry[0]) is entry:
+            del self._latest[entry[0]]
+        return entry[1], entry[2]
+
+class ClientConnection:
+    """Outbound side of a client socket, drained by its own writer task"""
+    
+    def __init__(self, client_id: str, websocket: websockets.WebSocketServerProtocol, queue: OutboundQueue = None,
+                 metrics: Optional[ServerMetrics] = None):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.codec = get_codec(getattr(websocket, 'subprotocol', None))
+        self.queue = queue if queue is not None else OutboundQueue()
+        self.clock = ClockEstimate()
+        self.resume_token: Optional[str] = None
+        self.closed = False
+        self.evicted = False
+        self.detached = False  # socket gone, seat kept until resume or timeout
+        self.resume_timer: Optional[WheelTimer] = None
+        self.last_seen = server_time()  # last frame or pong from the client
+        self.ping_sent_at: Optional[float] = None  # unanswered heartbeat ping, if any
+        self.heartbeat: Optional[WheelTimer] = None
+        self.ping_task: Optional[asyncio.Task] = None
+        self.writer_task = asyncio.create_task(self._writer())
+        self.close_task: Optional[asyncio.Task] = None
+        self.metrics = metrics
+    
+    def send(self, frame: Union[str, bytes], msg_type: str, shared: bool = False) -> bool:
+        """Queue an already serialized frame without waiting for the socket; shared if other sockets get it too"""
+        if self.closed:
+            return False
+        if not self.queue.put(msg_type, frame, shared):
+            self.evict()
+            return False
+        if self.metrics is not None:
+            self.metrics.sent(msg_type, len(frame))
+        return True
+    
+    def send_message(self, message: Dict) -> bool:
+        """Encode a message for this connection alone and queue it"""
+        return self.send(self.codec.encode(message), message['type'])
+    
+    def evict(self):
+        """Disconnect a client that fell too far behind"""
+        if self.evicted:
+            return
+        self.evicted = True
+        self.queue.counters['evicted'] += 1
+        self.close()
+        self.close_task = asyncio.create_task(
+            self.websocket.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+        )
+    
+    async def _writer(self):
+        """Write queued frames to the socket one at a time"""
+        try:
+            while True:
+                frame, shared = await self.queue.get()
+                # Read by the deflate extension, which sees only the payload
+                shared_frame.set(shared)
+                await self.websocket.send(frame)
+        except websockets.exceptions.ConnectionClosed:
+            self.closed = True
+    
+    def close(self):
+        """Stop the writer task and heartbeat and drop anything still queued"""
+        self.closed = True
+        self.writer_task.cancel()
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        self.queue.clear()
 
 class WatchRoomServer:
-    def __init__(self):
-        self.rooms: Dict[str, Dict] = {}
-        self.clients: Dict[str, websockets.WebSocketServerProtocol] = {}
+    def __init__(self, shard: Optional[ShardMap] = None, backplane: Optional[Backplane] = None):
+        self.shard = shard  # set when running as one worker of a sharded deployment
+        self.backplane = backplane  # set when rooms are shared with other server instances
+        self.redirects = 0
+        self.rooms: Dict[str, Room] = {}  # each run by its own RoomActor
+        self.clients: Dict[str, ClientConnection] = {}
         self.client_rooms: Dict[str, str] = {}  # client_id -> room_code
-        
+        self.user_clients: Dict[str, Set[str]] = {}  # user_id -> client_ids
+        self.sessions: Dict[str, str] = {}  # resume_token -> client_id
+        self.resume_grace = RESUME_GRACE_SECONDS
+        self.restore_grace = ROOM_RESTORE_GRACE_SECONDS
+        self.session_counters = {'resumed': 0, 'replayed_events': 0, 'snapshot_fallbacks': 0, 'expired': 0}
+        self.queue_counters = {'dropped': 0, 'coalesced': 0, 'evicted': 0}
+        self.playback_window = PLAYBACK_COALESCE_WINDOW_MS / 1000
+        self.playback_updates_coalesced = 0
+        self.timers = TimingWheel()  # heartbeats and resume grace periods
+        self.ping_interval = WEBSOCKET_PING_INTERVAL
+        self.ping_timeout = WEBSOCKET_PING_TIMEOUT
+        self.reaper_counters = {'pings_sent': 0, 'reaped': 0, 'rooms_freed': 0}
+        self.rate_limiter = RateLimiter()
+        self.draining = False
+        self.metrics = ServerMetrics()
+        self._add_state_metrics()
+    
+    def _add_state_metrics(self):
+        """Expose the server's own counters and sizes, read at scrape time"""
+        add = self.metrics.registry.add
+        add(Gauge('partywatch_connections', 'Client connections, including suspended ones awaiting resume',
+                  collect=lambda: len(self.clients)))
+        add(Gauge('partywatch_rooms', 'Rooms with a member on this server', collect=lambda: len(self.rooms)))
+        add(Gauge('partywatch_outbound_queue_frames', 'Frames waiting in outbound queues',
+                  collect=lambda: sum(len(connection.queue) for connection in self.clients.values())))
+        add(Gauge('partywatch_outbound_queue_max_frames', 'Deepest outbound queue',
+                  collect=lambda: max((len(connection.queue) for connection in self.clients.values()), default=0)))
+        add(Gauge('partywatch_room_mailbox_steps', 'Steps waiting in room actor mailboxes',
+                  collect=lambda: sum(room.actor.mailbox.qsize() for room in self.rooms.values())))
+        add(Gauge('partywatch_pending_timers', 'Heartbeat and resume timers on the timing wheel', collect=lambda: len(self.timers)))
+        add(Counter('partywatch_outbound_frames_total', 'Frames dropped, coalesced or evicting their slow consumer', ('outcome',),
+                    collect=lambda: {(key,): value for key, value in self.queue_counters.items()}))
+        add(Counter('partywatch_sessions_total', 'Session resume outcomes', ('outcome',),
+                    collect=lambda: {(key,): value for key, value in self.session_counters.items()}))
+        add(Counter('partywatch_heartbeat_total', 'Heartbeat pings sent, connections reaped and rooms freed', ('event',),
+                    collect=lambda: {(key,): value for key, value in self.reaper_counters.items()}))
+        add(Counter('partywatch_compressed_frame_cache_total', 'Shared frames found in or added to the compressed frame cache, '
+                    'and one-off frames compressed without it', ('outcome',),
+                    collect=lambda: {('hit',): frame_cache.hits, ('miss',): frame_cache.misses, ('uncached',): frame_cache.uncached}))
+        add(Counter('partywatch_throttled_messages_total', 'Client messages refused by the rate limiter', ('bucket',),
+                    collect=lambda: {(key,): value for key, value in self.rate_limiter.throttled.items()}))
+    
+    async def start(self):
+        """Start sampling loop lag and connect to the backplane, if any, before accepting clients"""
+        self.metrics.start()
+        if self.backplane is not None:
+            await self.backplane.start(self._on_backplane_event)
+    
+    async def close(self):
+        """Drop the rooms, stopping their actors, then stop loop lag sampling and disconnect from the backplane"""
+        # A stopped actor left in self.rooms would answer every join with None, and register_client would spin
+        for room_code in list(self.rooms):
+            self._drop_room(room_code)
+        self.metrics.stop()
+        if self.backplane is not None:
+            await self.backplane.close()
+    
+    def _room_actor(self, room_code: str) -> RoomActor:
+        """Get the actor running a room, opening the room if needed"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            room = self.rooms[room_code] = Room()
+            room.actor = RoomActor(room_code)
+            if self.backplane is not None:
+                # Queued first, so the room holds the other nodes' state before anyone joins
+                room.actor.tell(self._join_backplane, room_code)
+        return room.actor
+    
+    def _client_actor(self, client_id: str) -> Optional[RoomActor]:
+        """Get the actor running the room a client is in"""
+        room = self.rooms.get(self.client_rooms.get(client_id))
+        return room.actor if room is not None else None
+    
+    def _tell_client_room(self, client_id: str, step, *args):
+        """Queue a step on the room a client is in, if it is still in one"""
+        actor = self._client_actor(client_id)
+        if actor is not None:
+            actor.tell(step, *args)
+    
     async def register_client(self, websocket: websockets.WebSocketServerProtocol, room_code: str, user_id: str, username: str):
         """Register a new client connection"""
-        client_id = str(uuid.uuid4())
-        self.clients[client_id] = websocket
-        self.client_rooms[client_id] = room_code
-        
-        # Initialize room if it doesn't exist
-        if room_code not in self.rooms:
-            self.rooms[room_code] = {
-                'users': [],
-                'playback_state': {'playing': False, 'current_time': 0},
-                'chat_messages': [],
-                'host_id': None
-            }
+        while True:
+            client_id = await self._room_actor(room_code).ask(self._join, websocket, room_code, user_id, username)
+            if client_id is not None:
+                return client_id
+            # The room emptied and closed while the join was queued, so open it again
+    
+    def _join(self, websocket: websockets.WebSocketServerProtocol, room_code: str, user_id: str, username: str) -> Optional[str]:
+        """Add a client to a room, as a step of the room's actor"""
+        room = self.rooms.get(room_code)
+        if room is None or room.actor.task is not asyncio.current_task():
+            return None
         
-        # Add user to room
-        user_info = {
-            'id': user_id,
-            'username': username,
-            'client_id': client_id,
-            'joined_at': datetime.now().isoformat()
-        }
+        client_id = new_id()
+        connection = ClientConnection(client_id, websocket, OutboundQueue(counters=self.queue_counters), self.metrics)
+        connection.resume_token = self._issue_resume_token(client_id)
+        self._watch(connection)
+        self.clients[client_id] = connection
+        self.client_rooms[client_id] = room_code
+        self.user_clients.setdefault(user_id, set()).add(client_id)
         
-        if not self.rooms[room_code]['users']:
-            # First user becomes host
-            user_info['is_host'] = True
-            self.rooms[room_code]['host_id'] = user_id
-        else:
-            user_info['is_host'] = False
+        # Add user to room; the first user becomes host and a reconnecting host keeps the role
+        member = Member(user_id, username, client_id, is_host=room.host_id is None or room.host_id == user_id)
+        if member.is_host:
+            room.host_id = user_id
+            room.host_client_id = client_id
         
-        self.rooms[room_code]['users'].append(user_info)
+        room.members[client_id] = member
         
         # Notify other users in the room
-        await self.broadcast_to_room(room_code, {
+        self._broadcast(room_code, {
             'type': 'user_joined',
-            'user': user_info
+            'user': member.to_dict()
         }, exclude_client=client_id)
         
         # Send current room state to new user
-        await websocket.send(json.dumps({
+        self._send_room_state(connection, room_code, user_id)
+        
+        return client_id
+    
+    def _send_room_state(self, connection: ClientConnection, room_code: str, user_id: str, **extra):
+        """Send the join snapshot to one connection"""
+        room = self.rooms[room_code]
+        header = {
             'type': 'room_state',
-            'room': self.rooms[room_code],
-            'your_id': user_id
-        }))
+            'your_id': user_id,
+            'seq': room.seq,
+            'resume_token': connection.resume_token,
+            **extra
+        }
+        playback = self._playback_for(room_code, connection)
         
+        if connection.codec is not JSON_CODEC:
+            connection.send_message({**header, 'room': {'playback_state': playback, **self.get_room_view(room_code)}})
+            return
+        
+        # JSON joiners get the view spliced from cached fragments, so only the small per-client parts are encoded
+        fragment = self._json_view_fragment(room_code)
+        header_json = JSON_CODEC.encode(header)[:-1]
+        playback_json = JSON_CODEC.encode(playback)
+        connection.send(f'{header_json},"room":{{"playback_state":{playback_json},{fragment}}}}}', 'room_state')
+    
+    def _json_view_fragment(self, room_code: str) -> str:
+        """Encode the room view for JSON clients from each member's cached entry and the cached chat part"""
+        room = self.rooms[room_code]
+        users = ','.join([
+            self._user_fragment(room, user)
+            for members in (room.members, room.remote_members)
+            for user in members.values()
+        ])
+        head = JSON_CODEC.encode({'host_id': room.host_id, 'user_count': len(room.members) + len(room.remote_members)})
+        chat = room.chat_snapshot.get(JSON_CODEC.subprotocol)
+        if chat is None:
+            # Joined from the messages' cached encodings, once per change to the chat
+            start, end = room.chat.recent_range(JOIN_SNAPSHOT_CHAT_MESSAGES)
+            before = JSON_CODEC.encode(start if start > room.chat.first_cursor else None)
+            chat = room.chat_snapshot[JSON_CODEC.subprotocol] = \
+                f'"chat_messages":{room.chat.encoded(start, end)},"history_before":{before}'
+        return f'{head[1:-1]},"users":[{users}],{chat}'
+    
+    def _user_fragment(self, room: Room, user: Member) -> str:
+        """Get a member's room_state entry as JSON, encoded again only when it is replaced or its host flag changes"""
+        cached = room.user_fragments.get(user.client_id)
+        if cached is not None and cached[0] is user and cached[1] == user.is_host:
+            return cached[2]
+        fragment = JSON_CODEC.encode(self._user_view(user))
+        room.user_fragments[user.client_id] = (user, user.is_host, fragment)
+        return fragment
+    
+    def _issue_resume_token(self, client_id: str) -> str:
+        """Create the token a client presents to resume its session after a drop"""
+        token = secrets.token_urlsafe(16)
+        self.sessions[token] = client_id
+        return token
+    
+    def resume_client(self, websocket: websockets.WebSocketServerProtocol, room_code: str, token: str, last_seq) -> Optional[str]:
+        """Attach a new socket to a kept session, replaying only the events it missed"""
+        client_id = self.sessions.get(token)
+        if client_id is None or self.client_rooms.get(client_id) != room_code:
+            return None
+        
+        previous = self.clients[client_id]
+        if previous.resume_timer is not None:
+            previous.resume_timer.cancel()
+        if not previous.detached:
+            # The old socket is half-open; the resumed one takes over
+            previous.close()
+            previous.close_task = asyncio.create_task(previous.websocket.close(NORMAL_CLOSE_CODE, "Session resumed"))
+        del self.sessions[token]
+        
+        connection = ClientConnection(client_id, websocket, OutboundQueue(counters=self.queue_counters), self.metrics)
+        connection.clock = previous.clock
+        connection.resume_token = self._issue_resume_token(client_id)
+        self._watch(connection)
+        self.clients[client_id] = connection
+        self.session_counters['resumed'] += 1
+        
+        room = self.rooms[room_code]
+        replay = room.replay
+        oldest_seq = replay[0][0] if replay else room.seq + 1
+        missed = None
+        if isinstance(last_seq, int) and oldest_seq - 1 <= last_seq <= room.seq:
+            missed = [entry for entry in replay if entry[0] > last_seq and entry[1] != client_id]
+        
+        if missed is None or len(missed) >= connection.queue.high_water:
+            # The gap fell out of the ring, so fall back to a full snapshot
+            self.session_counters['snapshot_fallbacks'] += 1
+            self._send_room_state(connection, room_code, room.members[client_id].id, resumed=True)
+            return client_id
+        
+        connection.send_message({
+            'type': 'resumed',
+            'seq': room.seq,
+            'resume_token': connection.resume_token,
+            'replayed': len(missed)
+        })
+        for _, _, msg_type, frame in missed:
+            connection.send(frame.encode(connection.codec), msg_type, shared=True)
+        self.session_counters['replayed_events'] += len(missed)
         return client_id
     
     async def unregister_client(self, client_id: str):
         """Unregister a client connection"""
-        if client_id in self.client_rooms:
-            room_code = self.client_rooms[client_id]
-            
-            # Remove user from room
+        actor = self._client_actor(client_id)
+        if actor is not None:
+            await actor.ask(self._remove_clients, [client_id])
+    
+    def release_client(self, client_id: str, connection: ClientConnection, close_code: Optional[int]):
+        """Handle a closed socket: leave on a close the client sent with a leave code, otherwise keep the seat for a resume"""
+        if self.clients.get(client_id) is not connection:
+            # Superseded by a resumed connection
+            return
+        if close_code in LEAVE_CLOSE_CODES:
+            self._remove_clients([client_id])
+        else:
+            self._remove_clients(self._suspend_clients([client_id]))
+    
+    def _suspend_clients(self, client_ids: List[str]) -> List[str]:
+        """Keep dead connections' seats for the resume grace period, returning any that must go now"""
+        if self.resume_grace <= 0:
+            return list(client_ids)
+        
+        for client_id in client_ids:
+            connection = self.clients.get(client_id)
+            if connection is None or connection.detached:
+                continue
+            connection.close()
+            connection.detached = True
+            connection.resume_timer = self.timers.schedule(
+                self.resume_grace, self._tell_client_room, client_id, self._expire_session, client_id, connection
+            )
+        return []
+    
+    def _expire_session(self, client_id: str, connection: ClientConnection):
+        """Remove a suspended client that did not resume in time"""
+        if self.clients.get(client_id) is connection and connection.detached:
+            self.session_counters['expired'] += 1
+            self._remove_clients([client_id])
+    
+    def _watch(self, connection: ClientConnection):
+        """Start the heartbeat of a new connection"""
+        connection.heartbeat = self.timers.schedule(self.ping_interval, self._check_heartbeat, connection)
+    
+    def _check_heartbeat(self, connection: ClientConnection):
+        """Ping a connection that has gone quiet, reaping it if the previous ping went unanswered"""
+        if connection.closed or self.clients.get(connection.client_id) is not connection:
+            return
+        now = server_time()
+        
+        if connection.ping_sent_at is not None:
+            if connection.last_seen < connection.ping_sent_at:
+                self._tell_client_room(connection.client_id, self._reap, connection)
+                return
+            connection.ping_sent_at = None
+        
+        idle = now - connection.last_seen
+        if idle < self.ping_interval:
+            # Traffic since the last check counts as a heartbeat, so no ping is needed yet
+            connection.heartbeat = self.timers.schedule(self.ping_interval - idle, self._check_heartbeat, connection)
+            return
+        
+        connection.ping_sent_at = now
+        connection.ping_task = asyncio.create_task(self._ping(connection))
+        self.reaper_counters['pings_sent'] += 1
+        connection.heartbeat = self.timers.schedule(self.ping_timeout, self._check_heartbeat, connection)
+    
+    async def _ping(self, connection: ClientConnection):
+        """Send a protocol-level ping and note when the pong arrives"""
+        try:
+            pong = await connection.websocket.ping()
+            await pong
+        except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+            return
+        connection.last_seen = server_time()
+    
+    def _reap(self, connection: ClientConnection):
+        """Evict a client that stopped answering pings, freeing its room if it was the last one"""
+        if self.clients.get(connection.client_id) is not connection:
+            # Resumed or removed while the step was queued
+            return
+        self.reaper_counters['reaped'] += 1
+        room_count = len(self.rooms)
+        self._remove_clients([connection.client_id])
+        self.reaper_counters['rooms_freed'] += room_count - len(self.rooms)
+        # Most likely half-open, in which case close() gives up on the handshake after its timeout
+        connection.close_task = asyncio.create_task(
+            connection.websocket.close(HEARTBEAT_CLOSE_CODE, "Heartbeat timeout")
+        )
+    
+    def get_reaper_stats(self) -> Dict:
+        """Get heartbeat and idle-reaper counters"""
+        return {**self.reaper_counters, 'pending_timers': len(self.timers)}
+    
+    def get_rate_limit_stats(self) -> Dict:
+        """Get the number of messages refused per limit"""
+        return {'throttled': dict(self.rate_limiter.throttled)}
+    
+    def get_room_load_stats(self, limit: int = 10) -> Dict[str, Dict]:
+        """Get actor CPU time and mailbox depth of the busiest rooms, hottest first"""
+        rooms = sorted(self.rooms.items(), key=lambda item: item[1].actor.cpu_time, reverse=True)
+        return {room_code: room.actor.stats() for room_code, room in rooms[:limit]}
+    
+    async def drain(self, path: str = ROOM_SNAPSHOT_PATH, timeout: float = DRAIN_TIMEOUT_SECONDS):
+        """Snapshot every room to disk, then close every client with 1012 so it reconnects to the next process"""
+        self.draining = True
+        rooms = await self.snapshot_rooms(path)
+        print(f"Saved {rooms} rooms to {path}")
+        
+        closing = [
+            asyncio.create_task(connection.websocket.close(RESTART_CLOSE_CODE, "Server restarting"))
+            for connection in self.clients.values() if not connection.detached
+        ]
+        if closing:
+            await asyncio.wait(closing, timeout=timeout)
+    
+    async def snapshot_rooms(self, path: str) -> int:
+        """Write each room as one JSON line, taken on its actor after the steps already queued, returning the count"""
+        partial = path + '.tmp'
+        count = 0
+        with open(partial, 'w', encoding='utf-8') as snapshot:
+            for room_code, room in list(self.rooms.items()):
+                if self.rooms.get(room_code) is not room:
+                    # Dropped while an earlier room was being written
+                    continue
+                line = await room.actor.ask(self._room_snapshot_line, room_code)
+                if line is not None:
+                    snapshot.write(line)
+                    count += 1
+        # Readers never see a half-written snapshot
+        os.replace(partial, path)
+        return count
+    
+    def _room_snapshot_line(self, room_code: str) -> Optional[str]:
+        """Encode what a room needs to outlive a restart; members rejoin on their own"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            return None
+        header = JSON_CODEC.encode({
+            'room_code': room_code,
+            'host_id': room.host_id,
+            'seq': room.seq,
+            'playback': room.playback_state.to_shared()
+        })
+        # The chat is spliced in from the messages' cached encodings
+        chat = room.chat.encoded(*room.chat.recent_range(len(room.chat)))
+        return f'{header[:-1]},"chat_messages":{chat}}}\n'
+    
+    def restore_rooms(self, path: str = ROOM_SNAPSHOT_PATH) -> int:
+        """Reopen the rooms a drained server left in its snapshot, returning how many were restored"""
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, encoding='utf-8') as snapshot:
+            for line in snapshot:
+                try:
+                    record = JSON_CODEC.decode(line)
+                except DecodeError:
+                    continue
+                if self._restore_room(record):
+                    count += 1
+        # Restored once; a later crash must not bring back this state again
+        os.remove(path)
+        return count
+    
+    def _restore_room(self, record: Dict) -> bool:
+        """Open a room from its snapshot record, to be dropped if nobody rejoins it"""
+        room_code = record['room_code']
+        if room_code in self.rooms or (self.shard is not None and not self.shard.owns(room_code)):
+            return False
+        # Queued behind the backplane sync, so state still live on other nodes wins
+        self._room_actor(room_code).tell(self._load_room_snapshot, room_code, record)
+        self.timers.schedule(self.restore_grace, self._expire_restored_room, room_code, self.rooms[room_code])
+        return True
+    
+    def _load_room_snapshot(self, room_code: str, record: Dict):
+        """Apply a snapshot record to a freshly opened room"""
+        room = self.rooms.get(room_code)
+        if room is None or room.members or room.remote_members:
+            return
+        # A returning host reclaims the role on join, as after any reconnect
+        room.host_id = record['host_id']
+        room.seq = record['seq']
+        room.playback_state.load_shared(record['playback'])
+        for chat_msg in record['chat_messages']:
+            self._append_chat(room_code, ChatMessage.from_dict(chat_msg))
+    
+    def _expire_restored_room(self, room_code: str, room: Room):
+        """Queue settling a restored room once its members have had the grace period to rejoin"""
+        if self.rooms.get(room_code) is room:
+            room.actor.tell(self._settle_restored_room, room_code, room)
+    
+    def _settle_restored_room(self, room_code: str, room: Room):
+        """Drop a restored room nobody rejoined, or hand the host role on if only the host stayed away"""
+        if self.rooms.get(room_code) is not room:
+            return
+        if not room.members:
+            self._drop_room(room_code)
+        elif room.host_client_id is None and not room.remote_members:
+            self._reassign_host(room_code)
+    
+    def _remove_clients(self, client_ids: List[str]):
+        """Remove clients and notify their rooms, handling any newly dead ones as we go"""
+        pending = list(client_ids)
+        while pending:
+            notice = self._detach_client(pending.pop())
+            if notice is None:
+                continue
+            room_code, message = notice
+            self._relay(room_code, message)
             if room_code in self.rooms:
-                self.rooms[room_code]['users'] = [
-                    user for user in self.rooms[room_code]['users']
-                    if user.get('client_id') != client_id
-                ]
-                
-                # If room is empty, remove it
-                if not self.rooms[room_code]['users']:
-                    del self.rooms[room_code]
-                else:
-                    # Notify other users
-                    await self.broadcast_to_room(room_code, {
-                        'type': 'user_left',
-                        'client_id': client_id
-                    })
-            
-            del self.client_rooms[client_id]
+                pending.extend(self._suspend_clients(self._publish(room_code, message)))
+    
+    def _detach_client(self, client_id: str) -> Optional[Tuple[str, Dict]]:
+        """Drop a client from every index, returning the room notification to send if any"""
+        room_code = self.client_rooms.pop(client_id, None)
+        connection = self.clients.pop(client_id, None)
+        if connection is not None:
+            if connection.resume_timer is not None:
+                connection.resume_timer.cancel()
+            self.sessions.pop(connection.resume_token, None)
+            connection.close()
+        self.rate_limiter.forget(client_id)
+        
+        if room_code is None:
+            return None
+        
+        room = self.rooms.get(room_code)
+        if room is None:
+            return None
+        
+        member = room.members.pop(client_id, None)
+        if member is None:
+            return None
+        room.user_fragments.pop(client_id, None)
         
-        if client_id in self.clients:
-            del self.clients[client_id]
+        user_id = member.id
+        user_connections = self.user_clients.get(user_id)
+        if user_connections is not None:
+            user_connections.discard(client_id)
+            if not user_connections:
+                del self.user_clients[user_id]
+        
+        # If room is empty, remove it
+        if not room.members:
+            self._drop_room(room_code)
+            if not room.remote_members:
+                return None
+            # Members on other nodes carry on; they still need to hear about this one
+            if room.host_client_id == client_id:
+                room.host_id = next(iter(room.remote_members.values())).id
+        elif room.host_client_id == client_id:
+            self._reassign_host(room_code)
+        
+        return room_code, {
+            'type': 'user_left',
+            'client_id': client_id,
+            'host_id': room.host_id
+        }
+    
+    def _drop_room(self, room_code: str):
+        """Forget a room no local client is in any more"""
+        room = self.rooms.pop(room_code)
+        room.actor.stop()
+        self.metrics.fanout_seconds.remove(room_code)
+        if room.playback_timer is not None:
+            room.playback_timer.cancel()
+        if self.backplane is not None:
+            self.backplane.unsubscribe(room_code)
+    
+    def _reassign_host(self, room_code: str):
+        """Hand the host role to another connection of the host, or the oldest member"""
+        room = self.rooms[room_code]
+        members = room.members
+        
+        successor = None
+        for other_id in self.user_clients.get(room.host_id, ()):
+            if other_id in members:
+                successor = members[other_id]
+                break
+        if successor is None:
+            # Members are kept in join order, so the oldest one is first
+            successor = next(iter(members.values()))
+        
+        successor.is_host = True
+        room.host_id = successor.id
+        room.host_client_id = successor.client_id
+    
+    def get_host(self, room_code: str) -> Optional[Member]:
+        """Get the member record of the room host"""
+        room = self.rooms.get(room_code)
+        if not room or room.host_client_id is None:
+            return None
+        return room.members.get(room.host_client_id)
+    
+    def get_room_view(self, room_code: str) -> Dict:
+        """Get the compact member and chat summary sent in room_state (playback is added per send)"""
+        room = self.rooms[room_code]
+        chat_view = room.chat_snapshot.get('view')
+        if chat_view is None:
+            chat = room.chat
+            start, end = chat.recent_range(JOIN_SNAPSHOT_CHAT_MESSAGES)
+            chat_view = room.chat_snapshot['view'] = {
+                'chat_messages': chat.messages(start, end),
+                'history_before': start if start > chat.first_cursor else None
+            }
+        return {
+            'host_id': room.host_id,
+            'user_count': len(room.members) + len(room.remote_members),
+            'users': [
+                self._user_view(user)
+                for members in (room.members, room.remote_members)
+                for user in members.values()
+            ],
+            **chat_view
+        }
+    
+    def _user_view(self, user: Member) -> Dict:
+        """Get a member as listed in room_state"""
+        return {
+            'id': user.id,
+            'username': user.username,
+            'client_id': user.client_id,
+            'is_host': user.is_host
+        }
+    
+    def _append_chat(self, room_code: str, chat_msg: ChatMessage):
+        """Store a chat message under the room's next cursor"""
+        room = self.rooms[room_code]
+        # The ring keeps only the most recent messages
+        room.chat.append(chat_msg)
+        room.chat_snapshot.clear()
+        room.history_cache.clear()
+    
+    def _history_frame(self, room_code: str, codec, before: int, limit: int) -> Union[str, bytes]:
+        """Get an encoded chat_history page, cached until the room's chat changes"""
+        limit = max(1, min(limit, CHAT_HISTORY_PAGE_SIZE))
+        cache = self.rooms[room_code].history_cache
+        key = (codec.subprotocol, before, limit)
+        frame = cache.get(key)
+        if frame is None:
+            if codec is JSON_CODEC:
+                # Joined from the messages' cached encodings
+                chat = self.rooms[room_code].chat
+                start, end = chat.page_range(before, limit)
+                older = JSON_CODEC.encode(start if start > chat.first_cursor else None)
+                frame = f'{{"type":"chat_history","messages":{chat.encoded(start, end)},"before":{older}}}'
+            else:
+                frame = codec.encode({'type': 'chat_history', **self.get_chat_history(room_code, before, limit)})
+            cache[key] = frame
+        return frame
+    
+    def get_chat_history(self, room_code: str, before: int, limit: int = CHAT_HISTORY_PAGE_SIZE) -> Dict:
+        """Get a page of chat messages older than a cursor"""
+        chat = self.rooms[room_code].chat
+        start, end = chat.page_range(before, max(1, min(limit, CHAT_HISTORY_PAGE_SIZE)))
+        return {
+            'messages': chat.messages(start, end),
+            'before': start if start > chat.first_cursor else None
+        }
     
     async def broadcast_to_room(self, room_code: str, message: dict, exclude_client: str = None):
         """Broadcast message to all clients in a room"""
+        room = self.rooms.get(room_code)
+        if room is not None:
+            await room.actor.ask(self._broadcast, room_code, message, exclude_client)
+    
+    def _broadcast(self, room_code: str, message: dict, exclude_client: str = None, relay: bool = True):
+        """Fan a message out to a room, then deal with whatever connections turned out dead"""
         if room_code not in self.rooms:
             return
+        if relay:
+            self._relay(room_code, message)
+        dead = self._publish(room_code, message, exclude_client)
+        if dead:
+            self._remove_clients(self._suspend_clients(dead))
+    
+    def _publish(self, room_code: str, message: dict, exclude_client: str = None) -> List[str]:
+        """Sequence a room event, keep it for replay and fan it out, returning the dead client_ids"""
+        room = self.rooms[room_code]
+        room.seq += 1
+        message['seq'] = room.seq
+        frame = Frame(message)
+        room.replay.append((room.seq, exclude_client, message['type'], frame))
+        return self._fan_out(room_code, frame, message['type'], exclude_client)
+    
+    def _fan_out(self, room_code: str, frame: Frame, msg_type: str, exclude_client: str = None) -> List[str]:
+        """Hand a frame, encoded once per codec in use, to every writer in the room, returning the dead client_ids"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            return []
         
-        message_json = json.dumps(message)
-        for user in self.rooms[room_code]['users']:
-            client_id = user.get('client_id')
-            if client_id and client_id != exclude_client and client_id in self.clients:
-                try:
-                    await self.clients[client_id].send(message_json)
-                except websockets.exceptions.ConnectionClosed:
-                    # Remove disconnected client
-                    await self.unregister_client(client_id)
+        started = time.perf_counter()
+        dead = []
+        for client_id in room.members:
+            if client_id == exclude_client:
+                continue
+            connection = self.clients.get(client_id)
+            if connection is None:
+                dead.append(client_id)
+            elif connection.detached:
+                # Catches up from the replay ring if it resumes
+                continue
+            elif not connection.send(frame.encode(connection.codec), msg_type, shared=True):
+                dead.append(client_id)
+        self.metrics.fanout_seconds.observe(time.perf_counter() - started, room_code)
+        return dead
+    
+    def get_queue_stats(self) -> Dict:
+        """Get outbound queue depth and slow-consumer counters"""
+        depths = [len(connection.queue) for connection in self.clients.values()]
+        return {
+            'connections': len(depths),
+            'pending_frames': sum(depths),
+            'max_pending_frames': max(depths, default=0),
+            'frames_dropped': self.queue_counters['dropped'],
+            'frames_coalesced': self.queue_counters['coalesced'],
+            'slow_consumer_evictions': self.queue_counters['evicted'],
+            'playback_updates_coalesced': self.playback_updates_coalesced
+        }
+    
+    def _playback_for(self, room_code: str, connection: Optional[ClientConnection] = None) -> Dict:
+        """Get the playback state as it will be when a unicast frame reaches the connection"""
+        now = server_time()
+        if connection is not None:
+            # Pre-compensate for the measured one-way delay to this client
+            now += connection.clock.one_way_delay()
+        return self.rooms[room_code].playback_state.to_wire(now)
+    
+    def get_clock_stats(self, room_code: str) -> Dict[str, Dict]:
+        """Get clock offset, RTT and jitter estimates for every connection in a room"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            return {}
+        return {
+            client_id: self.clients[client_id].clock.stats()
+            for client_id in room.members if client_id in self.clients
+        }
+    
+    def _handle_clock_ping(self, connection: ClientConnection, message: dict, received_at: int):
+        """Answer an NTP-style clock ping, folding in the client's timing of the previous one"""
+        clock = connection.clock
+        previous_t3 = message.get('prev_t3')
+        if clock.pending is not None and previous_t3 is not None:
+            clock.add_sample(*clock.pending, float(previous_t3))
+        clock.pending = None
+        
+        t0 = message.get('t0')
+        if t0 is None:
+            return
+        
+        sent_at = to_wire_time(server_time())
+        clock.pending = (float(t0), received_at, sent_at)
+        connection.send_message({
+            'type': 'clock_pong',
+            't0': t0,
+            't1': received_at,
+            't2': sent_at,
+            'offset_ms': clock.offset_ms,
+            'rtt_ms': clock.rtt_ms
+        })
+    
+    def _schedule_lead(self, room_code: str) -> float:
+        """Pick how far ahead to schedule a sync point so the slowest member receives it in time"""
+        worst_rtt = 0.0
+        for client_id in self.rooms[room_code].members:
+            connection = self.clients.get(client_id)
+            if connection is not None and connection.clock.rtt_ms is not None:
+                clock = connection.clock
+                worst_rtt = max(worst_rtt, clock.rtt_ms + 4 * clock.jitter_ms)
+        lead_ms = min(SCHEDULED_SYNC_MAX_LEAD_MS, max(SCHEDULED_SYNC_MIN_LEAD_MS, worst_rtt + SCHEDULED_SYNC_MARGIN_MS))
+        return lead_ms / 1000
+    
+    def _schedule_user_action(self, room_code: str, client_id: str, message: dict):
+        """Schedule a play/pause/seek at a future server time and announce it to the whole room"""
+        action = message.get('action')
+        if action not in SCHEDULABLE_ACTIONS:
+            return
+        
+        state = self.rooms[room_code].playback_state
+        data = message.get('data') or {}
+        position = data.get('current_time') if isinstance(data, dict) else data
+        try:
+            position = None if position is None else client_number(position, 'current_time')
+        except ValueError as e:
+            self._reject(client_id, 'user_action', str(e))
+            return
+        
+        execute_at = server_time() + self._schedule_lead(room_code)
+        if position is None:
+            position = state.position(execute_at)
+        playing = state.playing if action == 'seek' else action == 'play'
+        state.set_anchor(playing, position, execute_at)
+        
+        fields = {'action': action, 'data': data, 'user_id': message.get('user_id')}
+        self._share_playback(room_code, fields)
+        self._announce_scheduled_action(room_code, fields)
+    
+    def _reject(self, client_id: str, msg_type: str, error: str):
+        """Tell a client its message was malformed and not applied"""
+        self.clients[client_id].send_message({'type': 'error', 'message_type': msg_type, 'error': error})
+    
+    def _announce_scheduled_action(self, room_code: str, fields: Dict):
+        """Send a scheduled user_action, executing at the playback anchor, to every local member"""
+        room = self.rooms[room_code]
+        state = room.playback_state
+        # Any held coalesced update is older than this transition
+        room.pending_playback = None
+        
+        # The sender is included so it starts at the same instant as everyone else
+        self._broadcast(room_code, {
+            'type': 'user_action',
+            **fields,
+            'execute_at': to_wire_time(state.anchor_time),
+            'playback_state': state.to_wire(state.anchor_time)
+        }, relay=False)
+    
+    def _playback_message(self, room_code: str) -> Dict:
+        """Build a playback_update carrying the room's current position"""
+        return {
+            'type': 'playback_update',
+            'playback_state': self.rooms[room_code].playback_state.to_wire()
+        }
+    
+    def _schedule_playback_update(self, room_code: str, client_id: str, immediate: bool = False):
+        """Send playback updates at most once per coalescing window, always sending play/pause edges at once"""
+        room = self.rooms[room_code]
+        
+        if immediate or room.playback_timer is None:
+            if room.pending_playback is not None:
+                # Superseded by this newer state
+                room.pending_playback = None
+                self.playback_updates_coalesced += 1
+            self._broadcast(room_code, self._playback_message(room_code), exclude_client=client_id, relay=False)
+            if room.playback_timer is None:
+                self._open_playback_window(room_code)
+            return
+        
+        if room.pending_playback is not None:
+            self.playback_updates_coalesced += 1
+        room.pending_playback = client_id
+    
+    def _open_playback_window(self, room_code: str):
+        """Hold further playback updates for this room until the window closes"""
+        loop = asyncio.get_running_loop()
+        room = self.rooms[room_code]
+        room.playback_timer = loop.call_later(
+            self.playback_window, room.actor.tell, self._close_playback_window, room_code
+        )
+    
+    def _close_playback_window(self, room_code: str):
+        """Send the newest state if an update was held during the window"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            return
+        
+        room.playback_timer = None
+        client_id = room.pending_playback
+        if client_id is None:
+            return
+        
+        room.pending_playback = None
+        self._broadcast(room_code, self._playback_message(room_code), exclude_client=client_id, relay=False)
+        if room_code in self.rooms:
+            self._open_playback_window(room_code)
+    
+    def _relay(self, room_code: str, message: Dict):
+        """Publish a room event to the other nodes, once for the whole room"""
+        if self.backplane is not None:
+            self.backplane.publish(room_code, {'kind': 'event', 'message': message})
+    
+    def _share_playback(self, room_code: str, action: Optional[Dict] = None):
+        """Publish the room's playback state, and the scheduled action that set it if any, to the other nodes"""
+        if self.backplane is None:
+            return
+        event = {'kind': 'playback', 'state': self.rooms[room_code].playback_state.to_shared()}
+        if action is not None:
+            event['action'] = action
+        self.backplane.publish(room_code, event)
+    
+    async def _join_backplane(self, room_code: str):
+        """Subscribe to a room's channel and adopt the presence, host and playback other nodes hold for it"""
+        await self.backplane.subscribe(room_code)
+        replies = await self.backplane.request_state(room_code, BACKPLANE_STATE_TIMEOUT_MS / 1000)
+        room = self.rooms.get(room_code)
+        if room is None or not replies:
+            return
+        
+        for state in replies:
+            for user in state['members']:
+                room.remote_members[user['client_id']] = Member.from_dict(user)
+        # Every node holds the same host, playback and recent chat, so any reply will do
+        state = replies[0]
+        if state['host_id'] is not None and room.host_client_id is None:
+            room.host_id = state['host_id']
+        room.playback_state.load_shared(state['playback'])
+        for chat_msg in state['chat_messages']:
+            self._append_chat(room_code, ChatMessage.from_dict(chat_msg))
+    
+    def _shared_room_state(self, room_code: str) -> Dict:
+        """Get this node's share of a room's state, for a node joining the room"""
+        room = self.rooms[room_code]
+        return {
+            'host_id': room.host_id,
+            'members': [member.to_dict() for member in room.members.values()],
+            'playback': room.playback_state.to_shared(),
+            'chat_messages': room.chat.messages(*room.chat.recent_range(JOIN_SNAPSHOT_CHAT_MESSAGES))
+        }
+    
+    def _set_host(self, room_code: str, host_id: Optional[str]):
+        """Adopt a host chosen on another node"""
+        room = self.rooms[room_code]
+        if host_id is None or host_id == room.host_id:
+            return
+        room.host_id = host_id
+        room.host_client_id = None
+        for members in (room.members, room.remote_members):
+            for client_id, user in members.items():
+                user.is_host = user.id == host_id
+                if user.is_host and room.host_client_id is None and members is room.members:
+                    room.host_client_id = client_id
+    
+    def _on_backplane_event(self, room_code: str, event: Dict):
+        """Queue another node's room event on the room's actor"""
+        room = self.rooms.get(room_code)
+        if room is not None:
+            room.actor.tell(self._apply_backplane_event, room_code, event)
+    
+    def _apply_backplane_event(self, room_code: str, event: Dict):
+        """Apply another node's room event and deliver it to the local members"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            return
+        kind = event.get('kind')
+        
+        if kind == 'state_request':
+            self.backplane.reply_state(room_code, event, self._shared_room_state(room_code))
+        
+        elif kind == 'playback':
+            state = room.playback_state
+            was_playing = state.playing
+            state.load_shared(event['state'])
+            if event.get('action') is not None:
+                self._announce_scheduled_action(room_code, event['action'])
+            else:
+                self._schedule_playback_update(room_code, REMOTE_ORIGIN, immediate=state.playing != was_playing)
+        
+        elif kind == 'event':
+            message = event['message']
+            msg_type = message.get('type')
+            if msg_type == 'user_joined':
+                room.remote_members[message['user']['client_id']] = Member.from_dict(message['user'])
+            elif msg_type == 'user_left':
+                room.remote_members.pop(message['client_id'], None)
+                room.user_fragments.pop(message['client_id'], None)
+                self._set_host(room_code, message.get('host_id'))
+            elif msg_type == 'chat_message':
+                # Stored under a local cursor so fetch_history paging works on this node
+                chat_msg = ChatMessage.from_dict(message['message'])
+                self._append_chat(room_code, chat_msg)
+                message = {'type': 'chat_message', 'message': chat_msg.to_dict()}
+            self._broadcast(room_code, message, relay=False)
     
     async def handle_message(self, websocket: websockets.WebSocketServerProtocol, client_id: str, message: dict):
         """Handle incoming messages from clients"""
-        room_code = self.client_rooms.get(client_id)
-        if not room_code or room_code not in self.rooms:
+        now = server_time()
+        actor = self._client_actor(client_id)
+        if actor is None:
             return
         
         msg_type = message.get('type')
         
+        # Refuse floods before they are queued, let alone fanned out to the room
+        retry_after = self.rate_limiter.check(client_id, msg_type, now)
+        if retry_after:
+            self.clients[client_id].send_message({
+                'type': 'throttled',
+                'message_type': msg_type,
+                'retry_after_ms': math.ceil(retry_after * 1000)
+            })
+            return
+        
+        await actor.ask(self._handle_message, client_id, message, now)
+    
+    def _handle_message(self, client_id: str, message: dict, now: float):
+        """Handle a client message received at server time now, as a step of its room's actor"""
+        room_code = self.client_rooms.get(client_id)
+        if room_code is None:
+            # Left while the message was queued
+            return
+        received_at = to_wire_time(now)
+        msg_type = message.get('type')
+        
         if msg_type == 'playback_update':
-            # Update playback state
-            self.rooms[room_code]['playback_state'] = message.get('playback_state', {})
+            # Apply the transition to the server timeline, clients never send position heartbeats
+            try:
+                is_edge = self.rooms[room_code].playback_state.apply(message.get('playback_state') or {})
+            except ValueError as e:
+                self._reject(client_id, msg_type, str(e))
+                return
+            self._share_playback(room_code)
             
             # Broadcast to other users
-            await self.broadcast_to_room(room_code, {
+            self._schedule_playback_update(room_code, client_id, immediate=is_edge)
+        
+        elif msg_type == 'sync_request':
+            # Resync a single client against the server timeline
+            connection = self.clients[client_id]
+            connection.send_message({
                 'type': 'playback_update',
-                'playback_state': self.rooms[room_code]['playback_state']
-            }, exclude_client=client_id)
+                'playback_state': self._playback_for(room_code, connection)
+            })
+        
+        elif msg_type == 'fetch_history':
+            # Older chat on demand, paged backwards from the 'before' cursor
+            connection = self.clients[client_id]
+            frame = self._history_frame(room_code, connection.codec, int(message.get('before', 0)),
+                                        int(message.get('limit', CHAT_HISTORY_PAGE_SIZE)))
+            # Pages are cached per room, so the same frame goes to every client that asks
+            connection.send(frame, 'chat_history', shared=True)
+        
+        elif msg_type == 'clock_ping':
+            # Clock sync: {t0} now, plus prev_t3 (when the previous pong arrived) once one has
+            self._handle_clock_ping(self.clients[client_id], message, received_at)
         
         elif msg_type == 'chat_message':
             # Add chat message
-            chat_msg = {
-                'id': str(uuid.uuid4()),
-                'user_id': message.get('user_id'),
-                'username': message.get('username'),
-                'message': message.get('message'),
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            self.rooms[room_code]['chat_messages'].append(chat_msg)
-            
-            # Keep only last 100 messages
-            if len(self.rooms[room_code]['chat_messages']) > 100:
-                self.rooms[room_code]['chat_messages'] = self.rooms[room_code]['chat_messages'][-100:]
+            chat_msg = ChatMessage(message.get('user_id'), message.get('username'), message.get('message'))
+            self._append_chat(room_code, chat_msg)
             
             # Broadcast to all users in room
-            await self.broadcast_to_room(room_code, {
+            self._broadcast(room_code, {
                 'type': 'chat_message',
-                'message': chat_msg
+                'message': chat_msg.to_dict()
             })
         
+        elif msg_type == 'user_action' and message.get('schedule'):
+            # Scheduled sync point: every client executes the action at the same server time
+            self._schedule_user_action(room_code, client_id, message)
+        
         elif msg_type == 'user_action':
             # Handle user actions (like seeking, play/pause)
-            await self.broadcast_to_room(room_code, {
+            self._broadcast(room_code, {
                 'type': 'user_action',
                 'action': message.get('action'),
                 'data': message.get('data'),
@@ -152,10 +1186,13 @@ class WatchRoomServer:
     async def handle_client(self, websocket: websockets.WebSocketServerProtocol, path: str):
         """Handle individual client connections"""
         client_id = None
+        connection = None
+        # Frames are decoded with the codec picked by subprotocol negotiation (JSON by default)
+        codec = get_codec(websocket.subprotocol)
         try:
             # Wait for initial connection message
             initial_message = await websocket.recv()
-            data = json.loads(initial_message)
+            data = codec.decode(initial_message)
             
             room_code = data.get('room_code')
             user_id = data.get('user_id')
@@ -165,15 +1202,39 @@ class WatchRoomServer:
                 await websocket.close(1008, "Missing required connection parameters")
                 return
             
-            # Register client
-            client_id = await self.register_client(websocket, room_code, user_id, username)
+            if self.draining:
+                await websocket.close(RESTART_CLOSE_CODE, "Server restarting")
+                return
+            
+            if self.shard is not None and not self.shard.owns(room_code):
+                # Room affinity: send the client to the worker that owns this room
+                self.redirects += 1
+                await websocket.send(codec.encode({
+                    'type': 'redirect',
+                    'room_code': room_code,
+                    'url': self.shard.owner_url(room_code)
+                }))
+                await websocket.close(REDIRECT_CLOSE_CODE, "Room is served by another worker")
+                return
+            
+            # Resume a dropped session if the client presents its token, otherwise register
+            if data.get('resume_token') and room_code in self.rooms:
+                client_id = await self.rooms[room_code].actor.ask(
+                    self.resume_client, websocket, room_code, data['resume_token'], data.get('last_seq')
+                )
+            if client_id is None:
+                client_id = await self.register_client(websocket, room_code, user_id, username)
+            connection = self.clients[client_id]
             
             # Handle incoming messages
             async for message in websocket:
+                connection.last_seen = server_time()
                 try:
-                    data = json.loads(message)
+                    data = codec.decode(message)
+                    msg_type = data.get('type')
+                    self.metrics.received(msg_type if msg_type in CLIENT_MESSAGE_TYPES else 'other', len(message))
                     await self.handle_message(websocket, client_id, data)
-                except json.JSONDecodeError:
+                except DecodeError:
                     continue
                 except Exception as e:
                     print(f"Error handling message: {e}")
@@ -184,17 +1245,125 @@ class WatchRoomServer:
         except Exception as e:
             print(f"Error in client handler: {e}")
         finally:
-            if client_id:
-                await self.unregister_client(client_id)
+            if connection is not None:
+                # Codes of closes the server started (heartbeat, restart) are only the client's echo
+                close_code = websocket.close_code if websocket.close_rcvd_then_sent else None
+                self._tell_client_room(client_id, self.release_client, client_id, connection, close_code)
+
+def serve_websocket(server: WatchRoomServer, host: str, port: int, **kwargs):
+    """Create the websockets server with PartyWatch's protocol options"""
+    # Tuned permessage-deflate; broadcast frames are compressed once for all recipients
+    extensions = deflate_extensions() if WEBSOCKET_COMPRESSION else None
+    # Keepalive pings come from the server's shared timing wheel instead of a task per connection
+    return websockets.serve(server.handle_client, host, port, subprotocols=SUBPROTOCOLS,
+                            compression=None, extensions=extensions, ping_interval=None,
+                            max_size=WEBSOCKET_MAX_MESSAGE_SIZE, **kwargs)
+
+async def _until_terminated():
+    """Wait for SIGTERM, or forever where the loop can't handle signals"""
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        pass
+    await stop.wait()
+
+async def _restart_gracefully(server: WatchRoomServer, websocket_servers: List, snapshot_path: str):
+    """Stop accepting connections, then hand the rooms over to the next process through the snapshot"""
+    for websocket_server in websocket_servers:
+        websocket_server.server.close()
+    await server.drain(snapshot_path)
+
+def _restore(server: WatchRoomServer, snapshot_path: str):
+    """Reopen the rooms the previous process drained, if any"""
+    restored = server.restore_rooms(snapshot_path)
+    if restored:
+        print(f"Restored {restored} rooms from {snapshot_path}")
+
+async def run_worker(worker_index: int, worker_urls: List[str]):
+    """Serve the rooms one shard owns, on its own port and the shared public port"""
+    server = WatchRoomServer(shard=ShardMap(worker_urls, worker_index),
+                             backplane=create_backplane(WEBSOCKET_BACKPLANE))
+    await server.start()
+    snapshot_path = f"{ROOM_SNAPSHOT_PATH}.{worker_index}"
+    _restore(server, snapshot_path)
+    
+    async with contextlib.AsyncExitStack() as stack:
+        stack.push_async_callback(server.close)
+        if METRICS_PORT:
+            metrics_server = await serve_metrics(server.metrics.registry, METRICS_HOST, METRICS_PORT + worker_index)
+            stack.enter_context(contextlib.closing(metrics_server))
+        websocket_servers = [await stack.enter_async_context(
+            serve_websocket(server, WEBSOCKET_HOST, WEBSOCKET_WORKER_BASE_PORT + worker_index)
+        )]
+        if SHARED_FRONT_PORT or worker_index == 0:
+            websocket_servers.append(await stack.enter_async_context(
+                serve_websocket(server, WEBSOCKET_HOST, WEBSOCKET_PORT, reuse_port=SHARED_FRONT_PORT)
+            ))
+        await _until_terminated()
+        await _restart_gracefully(server, websocket_servers, snapshot_path)
+
+def _worker_process(worker_index: int, worker_urls: List[str]):
+    """Entry point of a worker process"""
+    try:
+        asyncio.run(run_worker(worker_index, worker_urls))
+    except KeyboardInterrupt:
+        pass
+
+def run_sharded(workers: int):
+    """Run one worker process per shard, rooms assigned by consistent hashing on room_code"""
+    worker_urls = [
+        f"ws://{WEBSOCKET_PUBLIC_HOST}:{WEBSOCKET_WORKER_BASE_PORT + index}"
+        for index in range(workers)
+    ]
+    print(f"Starting PartyWatch WebSocket server with {workers} workers on ws://{WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
+    for url in worker_urls:
+        print(f"  worker {url}")
+    
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(index, worker_urls), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    
+    # Turn SIGTERM into a normal exit so the workers are stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Workers drain on SIGTERM; give them the time to save their rooms
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(DRAIN_TIMEOUT_SECONDS + 5)
 
 async def main():
     """Start the WebSocket server"""
-    server = WatchRoomServer()
+    server = WatchRoomServer(backplane=create_backplane(WEBSOCKET_BACKPLANE))
+    await server.start()
+    _restore(server, ROOM_SNAPSHOT_PATH)
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await serve_metrics(server.metrics.registry, METRICS_HOST, METRICS_PORT)
+        print(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
     
-    print("Starting PartyWatch WebSocket server on ws://localhost:8765")
+    print(f"Starting PartyWatch WebSocket server on ws://{WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
     
-    async with websockets.serve(server.handle_client, "localhost", 8765):
-        await asyncio.Future()  # run forever
+    try:
+        async with serve_websocket(server, WEBSOCKET_HOST, WEBSOCKET_PORT) as websocket_server:
+            await _until_terminated()
+            await _restart_gracefully(server, [websocket_server], ROOM_SNAPSHOT_PATH)
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        await server.close()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    if WEBSOCKET_WORKERS > 1:
+        run_sharded(WEBSOCKET_WORKERS)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+PartyWatch Wire Formats
+Message codecs negotiated through the WebSocket subprotocol
+"""
+
+import json
+from typing import Any, Dict, Optional, Sequence, Union
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # optional
+    cbor2 = None
+
+class DecodeError(ValueError):
+    """Raised when an incoming frame can't be decoded with the connection's codec"""
+
+class JsonCodec:
+    """Text JSON, the default for clients that don't ask for a subprotocol"""
+    subprotocol = 'partywatch.json'
+    binary = False
+    
+    def encode(self, message: Dict) -> str:
+        if orjson is not None:
+            return orjson.dumps(message).decode()
+        return json.dumps(message, separators=(',', ':'))
+    
+    def decode(self, data: Union[str, bytes]) -> Any:
+        try:
+            if orjson is not None:
+                return orjson.loads(data)
+            return json.loads(data)
+        except ValueError as e:
+            raise DecodeError(str(e)) from e
+
+class MsgpackCodec:
+    """Binary MessagePack encoding of the same message schema"""
+    subprotocol = 'partywatch.msgpack'
+    binary = True
+    
+    def encode(self, message: Dict) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+    
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            raise DecodeError("Expected a binary frame")
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise DecodeError(str(e)) from e
+
+class CborCodec:
+    """Binary CBOR encoding of the same message schema"""
+    subprotocol = 'partywatch.cbor'
+    binary = True
+    
+    def encode(self, message: Dict) -> bytes:
+        return cbor2.dumps(message)
+    
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            raise DecodeError("Expected a binary frame")
+        try:
+            return cbor2.loads(data)
+        except Exception as e:
+            raise DecodeError(str(e)) from e
+
+JSON_CODEC = JsonCodec()
+
+# Available codecs, in server preference order
+CODECS = [JSON_CODEC]
+if msgpack is not None:
+    CODECS.insert(0, MsgpackCodec())
+if cbor2 is not None:
+    CODECS.insert(len(CODECS) - 1, CborCodec())
+
+CODECS_BY_SUBPROTOCOL = {codec.subprotocol: codec for codec in CODECS}
+SUBPROTOCOLS = [codec.subprotocol for codec in CODECS]
+
+def get_codec(subprotocol: Optional[str]):
+    """Get the codec for a negotiated subprotocol, JSON when none was negotiated"""
+    return CODECS_BY_SUBPROTOCOL.get(subprotocol, JSON_CODEC)
+
+def negotiate_subprotocol(offered: Sequence[str]) -> Optional[str]:
+    """Pick the server's preferred subprotocol among those a client offered"""
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+class Frame:
+    """A message encoded at most once per codec, shared by all its recipients"""
+    __slots__ = ('message', '_encoded')
+    
+    def __init__(self, message: Dict):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+    
+    def encode(self, codec) -> Union[str, bytes]:
+        data = self._encoded.get(codec.subprotocol)
+        if data is None:
+            data = codec.encode(self.message)
+            self._encoded[codec.subprotocol] = data
+        return data